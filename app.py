@@ -2,17 +2,33 @@
 
 import argparse
 import copy
+import os
 import random
+import time
 from enum import Enum
 
-import pygame
-from pygame.locals import *
-
 import hex_coords
 from gameboard import GameBoard
+from gamestate import GameState
 from hex_coords import Layout
 
 
+# pygame is only imported once there's a display to draw on, so colours are
+# plain RGB tuples
+piece_palette = [
+    (0x12, 0x3A, 0xBC),
+    (0xAB, 0xC1, 0x23),
+    (0x1A, 0x2B, 0x3C),
+    (0xC3, 0xB2, 0xA1),
+]
+
+tile_palette = [
+    (0x2A, 0x30, 0x26),
+    (0xA3, 0x50, 0x6E),
+    (0xBE, 0x78, 0x3C),
+]
+
+
 class PlayerType(Enum):
     RANDOM = 0
     HUMAN = 1
@@ -23,11 +39,36 @@ class PlayerType(Enum):
     WARIO = 6
 
 
+def make_controller(p, i, bot_time_limit_ms=5000, bot_workers=1):
+    # The bot for player type p playing as player i
+    if p == PlayerType.RANDOM:
+        from bots.randombot import RandomBot
+        return RandomBot()
+    elif p == PlayerType.TRIVIAL_MCTS:
+        from bots.trivial_mcts import MctsPlayer
+        return MctsPlayer(i, bot_time_limit_ms)
+    elif p == PlayerType.EBL_MCTS:
+        import bots.ebl_mcts as ebl_mcts
+        return ebl_mcts.Player(i)
+    elif p == PlayerType.K2BD_MCTS:
+        from bots.k2bd_mcts import KevBot
+        return KevBot(i, bot_time_limit_ms, workers=bot_workers)
+    elif p == PlayerType.MJ:
+        from bots.mj import PengWin
+        return PengWin(i, bot_time_limit_ms)
+    elif p == PlayerType.WARIO:
+        from bots.wariobot import WarioBot
+        return WarioBot(i)
+
+
 class App:
     def __init__(
             self, players, display=True, bot_time_limit_ms=5000,
-            disable_time_limit=False, pieces=None, cols=7, rows=17):
+            disable_time_limit=False, pieces=None, cols=7, rows=17,
+            bot_workers=1, bot_processes=False, fps=30,
+            instrument_path=None, profile_dir=None, seed=None):
         self.display = display
+        self.fps = fps
 
         self._running = True
         self._display_surf = None
@@ -42,33 +83,38 @@ class App:
 
         self.layout = Layout(
             hex_coords.layout_flat, self.hex_size, hex_coords.Point(50, 50))
+        # Pixel vertices of each tile's hexagon, worked out once
+        self.polygons = {}
+
+        # The tiles pre-rendered, redrawn only when one is removed
+        self._board_surf = None
+        self._board_tiles = None
+        # What the last frame showed, and the screen areas it drew over the
+        # board, to be cleaned up next frame
+        self._last_frame = None
+        self._dirty = []
 
         self.controllers = []
         for i in range(len(players)):
             p = players[i]
             if p == PlayerType.HUMAN:
                 self.controllers.append(None)
-            elif p == PlayerType.RANDOM:
-                from bots.randombot import RandomBot
-                self.controllers.append(RandomBot())
-            elif p == PlayerType.TRIVIAL_MCTS:
-                from bots.trivial_mcts import MctsPlayer
-                self.controllers.append(MctsPlayer(i, bot_time_limit_ms))
-            elif p == PlayerType.EBL_MCTS:
-                import bots.ebl_mcts as ebl_mcts
-                self.controllers.append(ebl_mcts.Player(i))
-            elif p == PlayerType.K2BD_MCTS:
-                from bots.k2bd_mcts import KevBot
-                self.controllers.append(KevBot(i, bot_time_limit_ms))
-            elif p == PlayerType.MJ:
-                from bots.mj import PengWin
-                self.controllers.append(PengWin(i, bot_time_limit_ms))
-            elif p == PlayerType.WARIO:
-                from bots.wariobot import WarioBot
-                self.controllers.append(WarioBot(i))
+            elif bot_processes:
+                from botworker import BotWorker
+                self.controllers.append(BotWorker(
+                    p, i, bot_time_limit_ms, bot_workers,
+                    instrumented=instrument_path is not None))
+            else:
+                self.controllers.append(
+                    make_controller(p, i, bot_time_limit_ms, bot_workers))
 
+        # seed fixes the starting position, otherwise the global random
+        # state is used
         self.board = GameBoard(
-            len(players), pieces=pieces, cols=cols, rows=rows)
+            len(players), pieces=pieces, cols=cols, rows=rows, rng=seed)
+        # Compact mirror of the board, kept in step with it, for cheap
+        # legal move queries
+        self.state = GameState.from_board(self.board)
 
         self.pending_action = None
 
@@ -76,26 +122,57 @@ class App:
         self.score_spacing = 30
 
         self.selected_piece = None
+        # Coords of the tile under the mouse, if any
+        self.highlighted = None
+
+        # Per-player lists of how long each bot move took, in ms
+        self.move_times = [[] for _ in players]
+
+        # Every move made, or None for a pass, so bot worker processes can
+        # be sent just what happened since their last turn
+        self.move_log = []
+
+        # Instrumentation, which is only loaded if asked for: a JSON line
+        # per bot move, and a cProfile dump per bot move
+        self.players = players
+        self.instrument = None
+        self.move_records = None
+        self.profile_dir = profile_dir
+        if instrument_path is not None or profile_dir is not None:
+            import instrument
+            self.instrument = instrument
+        if instrument_path is not None:
+            instrument.install()
+            self.move_records = instrument.MoveLog(instrument_path)
 
     def on_init(self):
+        self._running = True
+
+        if not self.display:
+            # Headless games don't need pygame at all
+            return
+
+        global pygame
+        import pygame
         pygame.init()
         pygame.font.init()
 
-        if self.display:
-            self._display_surf = pygame.display.set_mode(
-                self.size, pygame.HWSURFACE | pygame.DOUBLEBUF)
-            self._background = pygame.Surface(self._display_surf.get_size())
-            self._background.fill((0, 0, 0))
-
-        self._running = True
+        self._display_surf = pygame.display.set_mode(
+            self.size, pygame.HWSURFACE | pygame.DOUBLEBUF)
+        self._background = pygame.Surface(self._display_surf.get_size())
+        self._background.fill((0, 0, 0))
 
         self.font = pygame.font.SysFont("arial", 16)
+        self.clock = pygame.time.Clock()
+
+    def tile_under_mouse(self):
+        # Coords of the board position under the mouse, or None
+        grid = self.board.geometry.grid
+        i = grid.pixel_to_id(self.layout, pygame.mouse.get_pos())
+        return None if i < 0 else grid.id_to_hex(i)
 
     def on_event(self, event):
-        mpos = pygame.mouse.get_pos()
-        sel_hex = hex_coords.pixel_to_hex(
-            self.layout, hex_coords.Point(mpos[0], mpos[1]))
-        selected = hex_coords.hex_round(sel_hex)
+        selected = self.tile_under_mouse()
 
         if event.type == pygame.QUIT:
             self._running = False
@@ -127,47 +204,78 @@ class App:
 
     def on_loop(self):
         # Player or AI moves
+        action = None
         if self.pending_action is not None:
-            self.board = self.board.takeAction(self.pending_action)
+            action = self.pending_action
             self.selected_piece = None
             self.pending_action = None
         elif self.controllers[self.board.current_player] is not None:
             self.selected_piece = None
-            # Pass in a deep copy of the board in case the bot wants to make
-            # any changes or monkey patch the reward function
-            c_time = pygame.time.get_ticks()
-            board = copy.deepcopy(self.board)
-            new_board = self.board.takeAction(
-                self.controllers[self.board.current_player].get_move(board))
-            time_taken = pygame.time.get_ticks() - c_time
-            if time_taken <= self.bot_time_limit:
-                self.board = new_board
+            controller = self.controllers[self.board.current_player]
+            if hasattr(controller, "wait_ready"):
+                controller.wait_ready()
+            path = None
+            if self.profile_dir is not None:
+                path = os.path.join(
+                    self.profile_dir, "move{}_player{}.prof".format(
+                        len(self.move_log), self.board.current_player))
+            if self.instrument is not None:
+                self.instrument.reset()
+            c_time = time.perf_counter()
+            preempted = False
+            if hasattr(controller, "request_move"):
+                # A BotWorker, which is cut off at the time limit, and
+                # profiles itself
+                timeout = None if self.disable_time_limit \
+                    else self.bot_time_limit / 1000
+                action = controller.request_move(
+                    self.board, self.move_log, timeout, profile_path=path)
+                preempted = action is None
             else:
+                # Pass in a deep copy of the board in case the bot wants to
+                # make any changes or monkey patch the reward function
+                board = copy.deepcopy(self.board)
+                if path is None:
+                    action = controller.get_move(board)
+                else:
+                    with self.instrument.profiled(path):
+                        action = controller.get_move(board)
+            time_taken = int(1000 * (time.perf_counter() - c_time))
+            self.move_times[self.board.current_player].append(time_taken)
+            bot_action = action
+            if time_taken > self.bot_time_limit or preempted:
                 msg = "Bot {} took too long by {} ms! Taking random action."
                 print(msg.format(
                     self.board.current_player,
-                    time_taken - self.bot_time_limit))
-                if self.disable_time_limit:
-                    self.board = new_board
-                else:
-                    self.board = self.board.takeAction(
-                        random.choice(self.board.getPossibleActions()))
+                    max(0, time_taken - self.bot_time_limit)))
+                if not self.disable_time_limit or preempted:
+                    action = random.choice(self.board.getPossibleActions())
+            if self.move_records is not None:
+                self.record_move(
+                    controller, bot_action, action, time_taken, preempted)
+
+        if action is not None:
+            new_board = self.board.takeAction(action)
+            if new_board is not self.board:
+                # The move was legal
+                self.state.apply(self.state.state_action(action))
+                self.board = new_board
+                self.move_log.append(action)
 
         # Tile Highlighting
-        for tile in self.board.board.values():
-            tile.highlighted = False
-        mpos = pygame.mouse.get_pos()
-        selected = hex_coords.hex_round(
-            hex_coords.pixel_to_hex(
-                self.layout, hex_coords.Point(mpos[0], mpos[1])))
-        if selected in self.board.board.keys():
-            self.board.board[selected].highlighted = True
-
-        orig_player = self.board.current_player
-        while len(self.board.getPossibleActions()) == 0:
-            self.board.current_player = (
-                self.board.current_player + 1) % self.board.nplayers
-            if self.board.current_player == orig_player:
+        if self.display:
+            self.highlighted = None
+            selected = self.tile_under_mouse()
+            if selected in self.board.board.keys():
+                self.highlighted = selected
+
+        orig_player = self.state.current_player
+        while not self.state.can_move(self.state.current_player):
+            self.state.current_player = (
+                self.state.current_player + 1) % self.state.nplayers
+            self.board.current_player = self.state.current_player
+            self.move_log.append(None)
+            if self.state.current_player == orig_player:
                 for i in range(len(self.board.players)):
                     player = self.board.players[i]
                     # Add all the player's current piece tiles to their score
@@ -177,40 +285,100 @@ class App:
                 self._running = False
                 break
 
+    def record_move(self, controller, bot_action, action, time_taken,
+                    preempted):
+        player = self.board.current_player
+        if hasattr(controller, "request_move"):
+            # Counted in the worker process
+            counters = controller.counters
+        else:
+            counters = self.instrument.snapshot()
+        self.move_records.record(
+            move=len(self.move_log),
+            player=player,
+            bot=self.players[player].name.lower(),
+            ms=time_taken,
+            limit_ms=self.bot_time_limit,
+            preempted=preempted,
+            # The bot's choice, and what was played if it was too slow
+            bot_action=bot_action,
+            action=action,
+            counters=counters,
+            stats=self.instrument.bot_stats(controller),
+        )
+
+    def frame_key(self):
+        # Everything on screen apart from the tiles themselves
+        return (
+            len(self.board.board),
+            tuple(piece.tile.coords for player in self.board.players
+                  for piece in player.pieces),
+            tuple(player.points for player in self.board.players),
+            self.board.current_player,
+            self.board.prev_move,
+            self.highlighted,
+            None if self.selected_piece is None
+            else self.selected_piece.tile.coords)
+
+    def render_board(self):
+        if not self.polygons:
+            # All the hexagons in one go
+            grid = self.board.geometry.grid
+            self.polygons = dict(zip(grid.hexes, grid.corners(self.layout)))
+        self._board_surf = self._background.copy()
+        for tile in self.board.board.values():
+            self.draw_hex(tile_palette[tile.value-1], tile.coords,
+                          surf=self._board_surf)
+            self.draw_hex(pygame.Color(0, 0, 0, 255), tile.coords, width=2,
+                          surf=self._board_surf)
+        self._board_tiles = len(self.board.board)
+
     def on_render(self):
         if not self.display:
             return
-        # Clear screen
-        self._display_surf.blit(self._background, (0, 0))
-
-        # Draw all tiles
-        for tile in self.board.board.values():
-            self.draw_hex(tile.color, tile.coords)
-            self.draw_hex(pygame.Color(0, 0, 0, 255), tile.coords, width=2)
-            if tile.occupant is not None:
-                player = tile.occupant.owner
-                self.draw_piece(player.color, tile.coords, self.piece_radius)
+        frame = self.frame_key()
+        if frame == self._last_frame:
+            # Nothing has changed
+            return
+        self._last_frame = frame
+
+        # Tiles are only ever removed, so the count tells us if it's stale
+        full = self._board_tiles != len(self.board.board)
+        if full:
+            self.render_board()
+            self._display_surf.blit(self._board_surf, (0, 0))
+        else:
+            # Rub out the last frame's pieces, lines and scores
+            for rect in self._dirty:
+                self._display_surf.blit(self._board_surf, rect, rect)
+
+        dirty = []
+
+        # Draw pieces
+        for i, player in enumerate(self.board.players):
+            for piece in player.pieces:
+                dirty.append(self.draw_piece(
+                    piece_palette[i], piece.tile.coords, self.piece_radius))
 
         # Add selection highlight
-        for tile in self.board.board.values():
-            if tile.highlighted:
-                self.draw_hex(tile.color, tile.coords, width=5)
+        if self.highlighted in self.board.board:
+            tile = self.board.board[self.highlighted]
+            dirty.append(self.draw_hex(
+                tile_palette[tile.value-1], tile.coords, width=5))
 
         # Draw previous move
         if self.board.prev_move is not None:
-            self.draw_line(
-                self.board.players[self.board.prev_move[0]].color,
+            dirty.append(self.draw_line(
+                piece_palette[self.board.prev_move[0]],
                 self.board.prev_move[1][0],
-                self.board.prev_move[1][1], width=2)
+                self.board.prev_move[1][1], width=2))
 
         # Draw a line to valid moves
-        for orig, targ in self.board.getPossibleActions():
-            if (self.selected_piece is not None) and \
-               (self.selected_piece.tile.coords == orig) and \
-               (targ in self.board.board.keys()):
-                self.draw_line(
-                    self.board.players[self.board.current_player].color,
-                    orig, targ, width=3)
+        if self.selected_piece is not None:
+            for orig, targ in self.board.getPossibleActions(self.selected_piece):
+                dirty.append(self.draw_line(
+                    piece_palette[self.board.current_player],
+                    orig, targ, width=3))
 
         # Draw scores
         for i in range(self.board.nplayers):
@@ -220,22 +388,22 @@ class App:
 
             # Draw a square around it if it's their turn
             if self.board.current_player == i:
-                pygame.draw.rect(
+                dirty.append(pygame.draw.rect(
                     self._display_surf, pygame.Color(255, 255, 255, 255),
                     pygame.Rect(
                         pos[0] - self.piece_radius-2,
                         pos[1] - self.piece_radius-2,
                         2*self.piece_radius+4,
-                        2*self.piece_radius+4), 2)
+                        2*self.piece_radius+4), 2))
             # Draw a game piece
-            pygame.draw.circle(
-                self._display_surf, player.color,
-                pos, self.piece_radius)
+            dirty.append(pygame.draw.circle(
+                self._display_surf, piece_palette[i],
+                pos, self.piece_radius))
             # Draw their score
             scoresurf = self.font.render(
                 "{}".format(player.points), True, (255, 255, 255))
-            self._display_surf.blit(
-                scoresurf, (pos[0] + 15, pos[1] - self.piece_radius))
+            dirty.append(self._display_surf.blit(
+                scoresurf, (pos[0] + 15, pos[1] - self.piece_radius)))
 
         # Add debug rectangles if we want
         # for orig, targ in self.board.getPossibleActions():
@@ -243,9 +411,21 @@ class App:
         #         self.draw_debug_square(
         #            pygame.Color(0,0,0,255), self.board.board[targ].coords)
 
-        pygame.display.flip()
+        if full:
+            pygame.display.flip()
+        else:
+            pygame.display.update(self._dirty + dirty)
+        self._dirty = dirty
 
     def on_cleanup(self):
+        for controller in self.controllers:
+            if hasattr(controller, "close"):
+                controller.close()
+        if self.move_records is not None:
+            self.move_records.close()
+            self.instrument.uninstall()
+        if not self.display:
+            return
         self.font = None
         pygame.font.quit()
         pygame.quit()
@@ -254,18 +434,24 @@ class App:
         self.on_init()
         self.on_render()
         while self._running:
-            for event in pygame.event.get():
-                self.on_event(event)
+            if self.display:
+                for event in pygame.event.get():
+                    self.on_event(event)
             self.on_loop()
             self.on_render()
+            if self.display:
+                # Don't spin faster than the screen needs, leaving the CPU
+                # to the bots
+                self.clock.tick(self.fps)
         self.on_cleanup()
 
-    def draw_hex(self, color, h, width=0):
+    def draw_hex(self, color, h, width=0, surf=None):
+        if h not in self.polygons:
+            self.polygons[h] = [
+                (p.x, p.y) for p in hex_coords.polygon_corners(self.layout, h)]
         return pygame.draw.polygon(
-            self._display_surf,
-            color,
-            [(p.x, p.y) for p in hex_coords.polygon_corners(self.layout, h)],
-            width)
+            self._display_surf if surf is None else surf,
+            color, self.polygons[h], width)
 
     def draw_piece(self, color, h, radius):
         pixel = hex_coords.hex_to_pixel(self.layout, h)
@@ -303,9 +489,31 @@ if __name__ == "__main__":
                         choices=[x.name.lower() for x in PlayerType],
                         default=['human', 'random'],
                         help='Players.')
+    parser.add_argument('-w',
+                        '--workers',
+                        type=int,
+                        default=1,
+                        help='Processes each parallel bot may search with.')
+    parser.add_argument('--bot-processes',
+                        action='store_true',
+                        help='Run each bot in its own long-lived process, '
+                             'cut off at the time limit.')
+    parser.add_argument('--instrument',
+                        default=None,
+                        metavar='FILE',
+                        help='Append a JSON line per bot move to FILE, with '
+                             'hot path call counts and bot search stats.')
+    parser.add_argument('--profile',
+                        default=None,
+                        metavar='DIR',
+                        help='Save a cProfile dump of every bot move to DIR.')
     args = parser.parse_args()
 
     # Parse players and start app.
     players = [PlayerType[x.upper()] for x in args.players]
-    theApp = App(players, bot_time_limit_ms=5000)  # , cols=5, rows=5)
+    theApp = App(players, bot_time_limit_ms=5000,
+                 bot_workers=args.workers,
+                 bot_processes=args.bot_processes,
+                 instrument_path=args.instrument,
+                 profile_dir=args.profile)  # , cols=5, rows=5)
     theApp.on_execute()
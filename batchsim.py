@@ -0,0 +1,232 @@
+#!/usr/bin/env python3
+'''Play many games at once in lockstep over NumPy arrays.
+
+Every game in a batch has the same board shape, number of players and
+pieces per player. Game state is held as arrays with a leading games axis:
+
+    fish      (games, tiles + 1)          tile values, 0 once removed
+    occupancy (games, tiles + 1)          0 for empty, else 1 + owner
+    free      (games, tiles + 1)          whether a piece can move onto a tile
+    pieces    (games, players, pieces)    tile index of each piece
+    points    (games, players)
+    current   (games,)                    player to move
+    passes    (games,)                    players in a row who couldn't move
+
+The extra last tile is a sentinel that is always missing, so rays can be
+padded out to the same length with it.
+'''
+
+import argparse
+import random
+import time
+
+import numpy as np
+
+from boardgen import default_pieces, generate_batch
+from gamestate import get_geometry
+
+
+class Batch:
+    def __init__(self, cols, rows, fish, pieces, current, rng=None):
+        self.geometry = get_geometry(cols, rows)
+        games, nplayers, pieces_per_player = pieces.shape
+        ntiles = self.geometry.ntiles
+
+        self.cols = cols
+        self.rows = rows
+        self.rng = np.random.default_rng() if rng is None else rng
+        self.ngames = games
+        self.nplayers = nplayers
+        self.pieces_per_player = pieces_per_player
+
+        # rays[i, d, k] is the k+1'th tile out from i in direction d, padded
+        # with the sentinel
+        length = max(len(ray) for rays in self.geometry.rays for ray in rays)
+        self.rays = np.full((ntiles, 6, length), ntiles, dtype=np.intp)
+        for i, rays in enumerate(self.geometry.rays):
+            for d, ray in enumerate(rays):
+                self.rays[i, d, :len(ray)] = ray
+
+        self.fish = np.zeros((games, ntiles + 1), dtype=np.int8)
+        self.fish[:, :ntiles] = fish
+        self.occupancy = np.zeros((games, ntiles + 1), dtype=np.int8)
+        self.pieces = pieces.astype(np.intp)
+        self.points = np.zeros((games, nplayers), dtype=np.int32)
+        self.current = current.astype(np.intp)
+        self.passes = np.zeros(games, dtype=np.intp)
+        self.finished = np.zeros(games, dtype=bool)
+
+        g = np.arange(games)[:, None, None]
+        owners = np.arange(nplayers)[None, :, None] + 1
+        self.occupancy[g, self.pieces] = owners
+        self.free = (self.fish != 0) & (self.occupancy == 0)
+
+    @classmethod
+    def from_boards(cls, boards):
+        '''Load GameBoards, which must all be the same shape.'''
+        geometry = boards[0].geometry
+        fish = np.zeros((len(boards), geometry.ntiles), dtype=np.int8)
+        pieces = np.zeros(
+            (len(boards), boards[0].nplayers, boards[0].pieces_per_player),
+            dtype=np.intp)
+        for g, board in enumerate(boards):
+            for coords, tile in board.board.items():
+                fish[g, geometry.index[coords]] = tile.value
+            for p, player in enumerate(board.players):
+                for k, piece in enumerate(player.pieces):
+                    pieces[g, p, k] = geometry.index[piece.tile.coords]
+        current = np.array([board.current_player for board in boards])
+        return cls(boards[0].cols, boards[0].rows, fish, pieces, current)
+
+    @classmethod
+    def random(cls, games, nplayers, pieces_per_player, cols=7, rows=17,
+               rng=None):
+        '''Random starting positions, with the same fish split as GameBoard.'''
+        if rng is None:
+            rng = np.random.default_rng()
+        fish, pieces, current = generate_batch(
+            games, cols, rows, nplayers, pieces_per_player, rng)
+        return cls(cols, rows, fish, pieces, current, rng)
+
+    def legal_moves(self, games=None):
+        '''Returns (origins, targets, mask) for the player to move in each of
+           games (default all of them). targets and mask have shape
+           (games, pieces * 6 * ray length), ordered by piece, then direction,
+           then distance, the same order as GameBoard.getPossibleActions.'''
+        if games is None:
+            games = np.arange(self.ngames)
+        origins = self.pieces[games, self.current[games]]
+        targets = self.rays[origins].reshape(len(games), -1)
+        # Gathering from the flattened array is much quicker than fancy
+        # indexing on two axes
+        stride = self.free.shape[1]
+        free = self.free.ravel().take(targets + (games * stride)[:, None])
+        mask = free.reshape(len(games), -1, self.rays.shape[2])
+        # A tile is reachable if every tile before it on the ray is free. Rays
+        # are short, so this beats logical_and.accumulate along the last axis
+        for k in range(1, mask.shape[2]):
+            mask[:, :, k] &= mask[:, :, k - 1]
+        return origins, targets, mask.reshape(len(games), -1)
+
+    def step(self, policy):
+        '''Every unfinished game makes one move, or passes if the player to
+           move is stuck. Games end when every player is stuck.'''
+        active = np.nonzero(~self.finished)[0]
+        origins, targets, mask = self.legal_moves(active)
+        movers = mask.any(axis=1)
+        choice = policy(self, active, targets, mask)
+
+        g = active[movers]
+        choice = choice[movers]
+        player = self.current[g]
+        slot = choice // (targets.shape[1] // self.pieces_per_player)
+        orig = origins[movers, slot]
+        targ = targets[movers, choice]
+
+        self.points[g, player] += self.fish[g, orig]
+        self.fish[g, orig] = 0
+        self.occupancy[g, orig] = 0
+        self.occupancy[g, targ] = player + 1
+        self.free[g, targ] = False
+        self.pieces[g, player, slot] = targ
+
+        self.passes[g] = 0
+        stuck = active[~movers]
+        self.passes[stuck] += 1
+        self.current[active] = (self.current[active] + 1) % self.nplayers
+
+        # Like App.on_loop, once nobody can move each piece's tile is scored
+        ended = stuck[self.passes[stuck] == self.nplayers]
+        if len(ended) > 0:
+            final = self.fish[ended[:, None, None], self.pieces[ended]]
+            self.points[ended] += final.sum(axis=2)
+            self.finished[ended] = True
+
+    def run(self, policy):
+        while not self.finished.all():
+            self.step(policy)
+        return self.points
+
+
+def random_policy(batch, games, targets, mask):
+    '''A uniformly random legal move in every game.'''
+    counts = mask.sum(axis=1)
+    picks = (batch.rng.random(len(games), dtype=np.float32) * counts).astype(np.intp)
+    # float32 rounding can land exactly on counts
+    picks = np.minimum(picks, counts - 1)
+    # The index of the picks'th legal move
+    return np.argmax(np.cumsum(mask, axis=1, dtype=np.int16) > picks[:, None], axis=1)
+
+
+def greedy_policy(batch, games, targets, mask):
+    '''The legal move onto the most fish, taking the first on ties.'''
+    stride = batch.fish.shape[1]
+    fish = batch.fish.ravel().take(targets + (games * stride)[:, None])
+    return np.argmax(np.where(mask, fish, -1), axis=1)
+
+
+class GreedyBot:
+    '''greedy_policy for the object model, for validation.'''
+    def get_move(self, currentState):
+        actions = currentState.getPossibleActions()
+        return max(actions, key=lambda a: currentState.board[a[1]].value)
+
+
+def validate(games=50, nplayers=2, pieces=None, cols=7, rows=17, seed=0):
+    '''Play the same greedy games in App and in a batch, and check the
+       final scores agree.'''
+    from app import App, PlayerType
+
+    apps = []
+    for g in range(games):
+        random.seed(seed + g)
+        app = App([PlayerType.RANDOM] * nplayers, display=False,
+                  disable_time_limit=True, pieces=pieces, cols=cols, rows=rows)
+        app.controllers = [GreedyBot() for _ in range(nplayers)]
+        apps.append(app)
+
+    batch = Batch.from_boards([app.board for app in apps])
+    points = batch.run(greedy_policy)
+
+    for g, app in enumerate(apps):
+        app.on_execute()
+        expected = [player.points for player in app.board.players]
+        if expected != list(points[g]):
+            raise AssertionError("Game {} scored {} in App but {} in batch".format(
+                g, expected, list(points[g])))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Batch self-play.')
+    parser.add_argument('-n', '--games', type=int, default=10000)
+    parser.add_argument('-p', '--players', type=int, default=2)
+    parser.add_argument('--pieces', type=int, default=None)
+    parser.add_argument('--cols', type=int, default=7)
+    parser.add_argument('--rows', type=int, default=17)
+    parser.add_argument('--policy', choices=['random', 'greedy'],
+                        default='random')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--validate', action='store_true',
+                        help='Check the rules against App first.')
+    args = parser.parse_args()
+
+    pieces = args.pieces
+    if pieces is None:
+        pieces = default_pieces(args.players)
+
+    if args.validate:
+        validate(nplayers=args.players, pieces=pieces,
+                 cols=args.cols, rows=args.rows, seed=args.seed)
+        print("Batch rules agree with App")
+
+    policy = {'random': random_policy, 'greedy': greedy_policy}[args.policy]
+    start = time.perf_counter()
+    batch = Batch.random(args.games, args.players, pieces,
+                         cols=args.cols, rows=args.rows,
+                         rng=np.random.default_rng(args.seed))
+    points = batch.run(policy)
+    elapsed = time.perf_counter() - start
+
+    print("{} games in {:.2f}s, {:.0f} games/s".format(
+        args.games, elapsed, args.games / elapsed))
+    print("Mean scores by seat: {}".format(points.mean(axis=0)))
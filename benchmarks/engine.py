@@ -0,0 +1,238 @@
+#!/usr/bin/env python3
+'''Throughput and memory of the game engine's hot paths.
+
+Micro benchmarks time single operations over a fixed set of seeded
+positions on several board sizes. Macro benchmarks play whole headless
+games for each bot against RandomBot. Results can be saved as a JSON
+baseline and later runs compared against it:
+
+    python benchmarks/engine.py --save engine.json
+    python benchmarks/engine.py --baseline engine.json
+'''
+
+import argparse
+import contextlib
+import copy
+import io
+import json
+import os
+import random
+import sys
+import time
+import tracemalloc
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from app import App, PlayerType
+from boardgen import generate
+from evaluate import evaluate_moves
+from gameboard import GameBoard
+from gamestate import GameState
+from bots.mcts_engine import MCTS
+from bots.mj import Netwerk
+
+SIZES = [(5, 9), (7, 17), (11, 25)]
+
+# Bots that play whole games. EBL_MCTS doesn't return moves yet.
+GAME_PLAYERS = [PlayerType.RANDOM, PlayerType.TRIVIAL_MCTS,
+                PlayerType.K2BD_MCTS, PlayerType.MJ, PlayerType.WARIO]
+
+
+def quiet():
+    # App prints the scores at the end
+    return contextlib.redirect_stdout(io.StringIO())
+
+
+def new_board(seed, cols, rows, nplayers=2, pieces=None):
+    return GameBoard(nplayers, pieces=pieces, cols=cols, rows=rows, rng=seed)
+
+
+def positions(cols, rows, count=20, seed=0):
+    '''Seeded boards from the opening to late in the game.'''
+    boards = []
+    for k in range(count):
+        board = new_board(seed + k, cols, rows)
+        rng = random.Random(seed + k)
+        for _ in range(rng.randrange(len(board.board) // 2)):
+            actions = board.getPossibleActions()
+            if not actions:
+                break
+            board.apply(rng.choice(actions))
+        board.history.clear()
+        boards.append(board)
+    return boards
+
+
+def rate(op, items, min_time):
+    '''Calls op on each of items, over and over for at least min_time
+       seconds, and returns calls per second.'''
+    calls = 0
+    start = time.perf_counter()
+    while True:
+        for item in items:
+            op(item)
+        calls += len(items)
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_time:
+            return calls / elapsed
+
+
+def allocated(make):
+    '''Bytes still held by whatever make() returns.'''
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    thing = make()
+    size = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    del thing
+    return size
+
+
+def playouts(boards, min_time):
+    '''MCTS playouts per second from the opening of each board, sharing
+       min_time between them.'''
+    nodes = 0
+    elapsed = 0
+    for board in boards:
+        search = MCTS()
+        search.search(GameState.from_board(board), 1000 * min_time / len(boards))
+        nodes += search.stats["nodes"]
+        elapsed += search.stats["nodes"] / search.stats["nodes_per_sec"]
+    return nodes / elapsed
+
+
+def micro(sizes=SIZES, min_time=0.2, seed=0):
+    results = {}
+    for cols, rows in sizes:
+        name = "{}x{} ".format(cols, rows)
+        boards = positions(cols, rows, seed=seed)
+        movable = [b for b in boards if b.getPossibleActions()]
+        moves = [(b, b.getPossibleActions()[0]) for b in movable]
+        states = [GameState.from_board(b) for b in boards]
+
+        def init(k):
+            return GameBoard(2, cols=cols, rows=rows, rng=k)
+
+        ops = {
+            "GameBoard.__init__": (init, range(5)),
+            "boardgen.generate":
+                (lambda k: generate(cols, rows, 2, 4, k), range(5)),
+            "getPossibleActions": (lambda b: b.getPossibleActions(), boards),
+            "takeAction": (lambda m: m[0].takeAction(m[1]), moves),
+            "isTerminal": (lambda b: b.isTerminal(), boards),
+            "reachable": (lambda b: b.reachable(0, 0), boards),
+            "Netwerk": (Netwerk, boards),
+            "GameState.from_board": (GameState.from_board, boards),
+            "GameState.getPossibleActions":
+                (lambda s: s.getPossibleActions(), states),
+            "evaluate_moves": (evaluate_moves, states),
+        }
+        random.seed(seed)
+        for op_name, (op, items) in ops.items():
+            results[name + op_name] = {
+                "ops_per_sec": rate(op, list(items), min_time)}
+
+        openings = [new_board(seed + k, cols, rows) for k in range(5)]
+        results[name + "MCTS opening"] = {
+            "playouts_per_sec": playouts(openings, 2 * min_time)}
+
+        # Memory, in bytes per object, over the same positions
+        results[name + "GameBoard bytes"] = {
+            "bytes": allocated(lambda: copy.deepcopy(boards)) // len(boards)}
+        results[name + "GameState bytes"] = {
+            "bytes": allocated(lambda: [s.copy() for s in states]) // len(states)}
+        results[name + "Netwerk bytes"] = {
+            "bytes": allocated(lambda: [Netwerk(b) for b in boards]) // len(boards)}
+    return results
+
+
+def macro(players=GAME_PLAYERS, games=1, cols=7, rows=17,
+          bot_time_limit_ms=250, seed=0):
+    '''Whole headless games of each bot against RandomBot. Searching bots
+       use up their time limit, so for them this mostly shows overheads
+       and that they still run.'''
+    results = {}
+    for player in players:
+        elapsed = 0
+        move_times = []
+        for game in range(games):
+            random.seed(seed + game)
+            with quiet():
+                app = App([player, PlayerType.RANDOM], display=False,
+                          bot_time_limit_ms=bot_time_limit_ms,
+                          disable_time_limit=True, cols=cols, rows=rows)
+                start = time.perf_counter()
+                app.on_execute()
+                elapsed += time.perf_counter() - start
+            move_times += app.move_times[0]
+        results["game {} vs random".format(player.name.lower())] = {
+            "games_per_sec": games / elapsed,
+            "ms_per_bot_move": sum(move_times) / max(len(move_times), 1),
+        }
+    return results
+
+
+def compare(results, baseline, tolerance=1.25):
+    '''Messages for everything more than tolerance times worse than
+       baseline.'''
+    regressions = []
+    for name, result in results.items():
+        for metric, value in result.items():
+            before = baseline.get(name, {}).get(metric)
+            if before is None:
+                continue
+            # Rates should go up, times and sizes down
+            higher_is_better = metric.endswith("per_sec")
+            if higher_is_better and value * tolerance < before \
+                    or not higher_is_better and value > before * tolerance:
+                regressions.append("{} {}: {:.6g} -> {:.6g}".format(
+                    name, metric, before, value))
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Benchmark the game engine.')
+    parser.add_argument('--min-time', type=float, default=0.2,
+                        help='Seconds to spend on each micro benchmark.')
+    parser.add_argument('--games', type=int, default=1,
+                        help='Games per bot in the macro benchmarks.')
+    parser.add_argument('-t', '--time-limit', type=int, default=250,
+                        help='Bot time limit per move in ms for macro games.')
+    parser.add_argument('--no-micro', action='store_true')
+    parser.add_argument('--no-macro', action='store_true')
+    parser.add_argument('-s', '--seed', type=int, default=0)
+    parser.add_argument('--save', default=None,
+                        help='Write the results to this JSON file.')
+    parser.add_argument('--baseline', default=None,
+                        help='Fail if worse than this saved JSON file.')
+    parser.add_argument('--tolerance', type=float, default=1.25,
+                        help='How many times worse than baseline is allowed.')
+    args = parser.parse_args()
+
+    results = {}
+    if not args.no_micro:
+        results.update(micro(min_time=args.min_time, seed=args.seed))
+    if not args.no_macro:
+        results.update(macro(games=args.games, seed=args.seed,
+                             bot_time_limit_ms=args.time_limit))
+
+    for name, result in results.items():
+        print("{:<40}{}".format(name, "  ".join(
+            "{} {:.6g}".format(metric, value)
+            for metric, value in result.items())))
+
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.tolerance)
+        if regressions:
+            print("Worse than baseline:")
+            for regression in regressions:
+                print("  " + regression)
+            sys.exit(1)
+        print("No regressions against {}".format(args.baseline))
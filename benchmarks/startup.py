@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+'''How long it takes a fresh process to get ready to play.
+
+Each case runs in its own interpreter, the way tournament and bot worker
+processes start, and the median over several runs is reported. Compare
+against a saved baseline to catch startup regressions:
+
+    python benchmarks/startup.py --save benchmarks/startup.json
+    python benchmarks/startup.py --baseline benchmarks/startup.json
+'''
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# name: code to time
+CASES = {
+    "import hex_coords": "import hex_coords",
+    "import gamestate": "import gamestate",
+    "import app": "import app",
+    "headless board": "from app import App, PlayerType\n"
+                      "App([PlayerType.RANDOM] * 2, display=False)",
+}
+for _bot in ["random", "trivial_mcts", "ebl_mcts", "k2bd_mcts", "mj", "wario"]:
+    CASES["make " + _bot] = \
+        "from app import make_controller, PlayerType\n" \
+        "make_controller(PlayerType.{}, 0)".format(_bot.upper())
+
+# Modules that headless processes shouldn't load
+HEAVY = ["pygame", "numpy"]
+
+CHILD = '''
+import sys, time
+start = time.perf_counter()
+{stmt}
+elapsed = time.perf_counter() - start
+print(elapsed, *[m for m in {heavy!r} if m in sys.modules])
+'''
+
+
+def run_case(stmt):
+    '''Returns (seconds for stmt, seconds for the whole process, heavy
+       modules it loaded).'''
+    code = CHILD.format(stmt=stmt, heavy=HEAVY)
+    start = time.perf_counter()
+    out = subprocess.run(
+        [sys.executable, "-c", code], cwd=ROOT, check=True,
+        stdout=subprocess.PIPE, universal_newlines=True).stdout
+    wall = time.perf_counter() - start
+    # Anything the code under test printed comes first
+    fields = out.splitlines()[-1].split()
+    return float(fields[0]), wall, fields[1:]
+
+
+def measure(repeat=5, cases=None):
+    results = {}
+    for name, stmt in CASES.items():
+        if cases and name not in cases:
+            continue
+        runs = [run_case(stmt) for _ in range(repeat)]
+        results[name] = {
+            "ms": 1000 * statistics.median(r[0] for r in runs),
+            "process_ms": 1000 * statistics.median(r[1] for r in runs),
+            "loaded": runs[0][2],
+        }
+    return results
+
+
+def compare(results, baseline, tolerance=1.5, slack_ms=5):
+    '''Names of cases that got slower than tolerance times their baseline
+       (plus some slack, since tiny times are noisy) or started loading
+       modules they didn't before.'''
+    regressions = []
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        before = baseline[name]
+        if result["ms"] > before["ms"] * tolerance + slack_ms \
+                or set(result["loaded"]) - set(before["loaded"]):
+            regressions.append(name)
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Time process startup.')
+    parser.add_argument('-r', '--repeat', type=int, default=5)
+    parser.add_argument('--cases', nargs='+', default=None,
+                        help='Only run these cases.')
+    parser.add_argument('--save', default=None,
+                        help='Write the results to this JSON file.')
+    parser.add_argument('--baseline', default=None,
+                        help='Fail if slower than this saved JSON file.')
+    parser.add_argument('--tolerance', type=float, default=1.5,
+                        help='How many times slower than baseline is allowed.')
+    args = parser.parse_args()
+
+    results = measure(args.repeat, args.cases)
+    for name, result in results.items():
+        print("{:<22}{:8.1f} ms {:8.1f} ms process  {}".format(
+            name, result["ms"], result["process_ms"],
+            " ".join(result["loaded"])))
+
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.tolerance)
+        if regressions:
+            print("Slower than baseline: {}".format(", ".join(regressions)))
+            sys.exit(1)
+        print("No regressions against {}".format(args.baseline))
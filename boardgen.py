@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+'''Seeded random starting positions.
+
+Positions are given by tile index into the board's geometry, as (fish,
+pieces, current player): fish[i] is tile i's value, and pieces[p] lists
+player p's piece tiles.'''
+
+import random
+
+from gamestate import get_geometry
+
+
+def default_pieces(nplayers):
+    '''Pieces per player for the standard game, or None if it doesn't
+       support that many players.'''
+    return {2: 4, 3: 3, 4: 2}.get(nplayers)
+
+
+def fish_bank(ntiles):
+    '''How many tiles have 1, 2 and 3 fish: a sixth have 3, a third have 2
+       and the rest have 1.'''
+    bank = [0, ntiles//3, ntiles//6]
+    bank[0] = ntiles - sum(bank)
+    return bank
+
+
+def make_rng(rng):
+    '''A random.Random from a seed or an existing one. None means the
+       random module itself, which has the same methods and uses the
+       global state.'''
+    if rng is None:
+        return random
+    if isinstance(rng, random.Random):
+        return rng
+    return random.Random(rng)
+
+
+def generate(cols, rows, nplayers, pieces_per_player, rng=None):
+    '''One random starting position. rng can be a seed or a random.Random.'''
+    rng = make_rng(rng)
+    ntiles = get_geometry(cols, rows).ntiles
+    if nplayers * pieces_per_player > ntiles:
+        raise ValueError("{} pieces won't fit on {} tiles".format(
+            nplayers * pieces_per_player, ntiles))
+
+    fish = []
+    for value, count in enumerate(fish_bank(ntiles)):
+        fish += [value + 1] * count
+    rng.shuffle(fish)
+
+    placed = rng.sample(range(ntiles), nplayers * pieces_per_player)
+    pieces = [placed[p * pieces_per_player:(p + 1) * pieces_per_player]
+              for p in range(nplayers)]
+    return fish, pieces, rng.randrange(nplayers)
+
+
+def generate_batch(count, cols, rows, nplayers, pieces_per_player, rng=None):
+    '''count random starting positions as NumPy arrays:
+
+           fish     (count, tiles)              int8
+           pieces   (count, players, pieces)    intp
+           current  (count,)                    intp
+
+       rng can be a seed or a numpy.random.Generator.'''
+    import numpy as np
+    if not isinstance(rng, np.random.Generator):
+        rng = np.random.default_rng(rng)
+    ntiles = get_geometry(cols, rows).ntiles
+    if nplayers * pieces_per_player > ntiles:
+        raise ValueError("{} pieces won't fit on {} tiles".format(
+            nplayers * pieces_per_player, ntiles))
+
+    layout = np.repeat(np.arange(1, 4, dtype=np.int8), fish_bank(ntiles))
+    fish = rng.permuted(np.tile(layout, (count, 1)), axis=1)
+    # The first few tiles of a random permutation of each board
+    placements = np.argsort(rng.random((count, ntiles)), axis=1)
+    pieces = placements[:, :nplayers * pieces_per_player].reshape(
+        count, nplayers, pieces_per_player)
+    current = rng.integers(0, nplayers, count).astype(np.intp)
+    return fish, pieces, current
+
+
+def batches(total, batch_size, cols, rows, nplayers, pieces_per_player,
+            seed=None):
+    '''Yields generate_batch results of up to batch_size positions until
+       total have been made, all from one seeded generator.'''
+    import numpy as np
+    rng = np.random.default_rng(seed)
+    while total > 0:
+        count = min(batch_size, total)
+        yield generate_batch(count, cols, rows, nplayers, pieces_per_player, rng)
+        total -= count
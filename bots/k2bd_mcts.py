@@ -1,22 +1,91 @@
 #!/usr/bin/env python3
 
-from mcts import mcts
-from gameboard import GameBoard
+import random
+import sys
 
-def getReward(self):
-    if not self.isTerminal():
-        return False
+from bots.mcts_engine import MCTS
+from gamestate import GameState
 
-    scorediff = min(self.players[self.PROTAGONIST].points - self.players[i].points for i in range(self.nplayers) if i != self.PROTAGONIST)
+def score_difference(points, player):
+    # Margin over the closest opponent
+    scorediff = min(points[player] - points[i] for i in range(len(points)) if i != player)
 
     return scorediff
 
+# Each worker process keeps its own tree between moves.
+_worker_brain = None
+
+def search_root(state, seed, time_lim_ms, counting=False):
+    # Runs in a worker process. Returns {action: (visits, total reward)} for
+    # the root's children, the search's stats, and with counting, the hot
+    # path counts for the search (see instrument.py).
+    global _worker_brain
+    if _worker_brain is None:
+        _worker_brain = MCTS(reward=score_difference)
+    if counting:
+        import instrument
+        instrument.install()
+        instrument.reset()
+    random.seed(seed)
+    _worker_brain.search(state, time_lim_ms)
+    counts = instrument.snapshot() if counting else None
+    return _worker_brain.root_stats(), _worker_brain.stats, counts
+
+def warm_up():
+    pass
+
 class KevBot:
-    def __init__(self, pnum, time_lim_ms=5000):
+    def __init__(self, pnum, time_lim_ms=5000, workers=1):
         self.pnum = pnum
-        self.brain = mcts(timeLimit=time_lim_ms-100)
+        self.workers = workers
+        if workers > 1:
+            # Root parallelism: every worker searches the same root with its
+            # own seed, and the results are pooled. The pool lives as long as
+            # the bot so processes aren't started every move.
+            from concurrent.futures import ProcessPoolExecutor
+            self.time_lim_ms = time_lim_ms - 250
+            self.pool = ProcessPoolExecutor(max_workers=workers)
+            for future in [self.pool.submit(warm_up) for _ in range(workers)]:
+                future.result()
+        else:
+            self.time_lim_ms = time_lim_ms - 100
+            self.brain = MCTS(reward=score_difference)
+
+    def close(self):
+        if self.workers > 1:
+            self.pool.shutdown()
 
     def get_move(self, initialState):
-        initialState.PROTAGONIST = self.pnum
-        initialState.getReward = getReward.__get__(initialState, GameBoard)
-        return self.brain.search(initialState=initialState)
\ No newline at end of file
+        state = GameState.from_board(initialState)
+        if self.workers > 1:
+            return state.board_action(self.parallel_search(state))
+        action = self.brain.search(state, self.time_lim_ms)
+        self.stats = self.brain.stats
+        return state.board_action(action)
+
+    def parallel_search(self, state):
+        # If this process is counting hot path calls (instrument is only
+        # ever loaded to do that), the workers count theirs too and they're
+        # added in here
+        instrument = sys.modules.get("instrument")
+        counting = instrument is not None and instrument.installed()
+        futures = [self.pool.submit(search_root, state, random.getrandbits(32),
+                                    self.time_lim_ms, counting)
+                   for _ in range(self.workers)]
+
+        visits = {}
+        rewards = {}
+        self.stats = {"nodes": 0, "depth": 0, "nodes_per_sec": 0, "reused": 0}
+        for future in futures:
+            root_stats, stats, counts = future.result()
+            if counting:
+                instrument.merge(counts)
+            for action, (n, reward) in root_stats.items():
+                visits[action] = visits.get(action, 0) + n
+                rewards[action] = rewards.get(action, 0) + reward
+            for key in ("nodes", "nodes_per_sec", "reused"):
+                self.stats[key] += stats[key]
+            self.stats["depth"] = max(self.stats["depth"], stats["depth"])
+
+        # Most visited, then best average reward
+        return max(visits, key=lambda a: (visits[a], rewards[a] / visits[a]))
@@ -0,0 +1,205 @@
+#!/usr/bin/env python3
+
+import math
+import random
+import time
+
+from endgame import solve_position
+
+
+class Node:
+    '''A search tree node. States aren't stored: they are re-derived on the
+       way down by applying each node's action to the root state.'''
+    __slots__ = ('action', 'children', 'untried', 'visits', 'reward')
+
+    def __init__(self, action):
+        # The move into this node, or None for a pass
+        self.action = action
+        self.children = []
+        # Actions not yet expanded, filled in on the first visit
+        self.untried = None
+        self.visits = 0
+        # Total reward for the player who made action
+        self.reward = 0.0
+
+
+def win_loss(points, player):
+    '''1 for an outright win, otherwise -1.'''
+    if all(points[player] > p for i, p in enumerate(points) if i != player):
+        return 1
+    else:
+        return -1
+
+
+def legal_actions(state):
+    '''Like state.getPossibleActions, but a player who can't move passes
+       until nobody can.'''
+    actions = state.getPossibleActions()
+    if not actions and not state.game_over():
+        return [None]
+    return actions
+
+
+class MCTS:
+    '''UCT over GameState, for any number of players.
+
+       reward(final points, player) scores a finished game for one player.
+       The tree is kept between searches: the next search starts from
+       whichever subtree matches the position it is given.'''
+    def __init__(self, reward=win_loss, exploration=1 / math.sqrt(2)):
+        self.reward = reward
+        self.exploration = exploration
+        self.root = None
+        self.root_state = None
+        # Figures for the last search, in the form bots report them
+        self.stats = {}
+        self.max_depth = 0
+
+    def search(self, state, time_limit_ms):
+        '''Search until the time limit and return the most visited action.'''
+        start = time.perf_counter()
+        deadline = start + time_limit_ms / 1000
+        self.advance(state)
+        reused = self.root.visits
+        self.max_depth = 0
+        # Descend on a private copy, so the caller's state is left alone.
+        # Its islands are kept up to date, so checking whether a leaf can be
+        # solved exactly is cheap.
+        root_state = self.root_state.copy()
+        root_state.islands()
+        while True:
+            self.iterate(root_state)
+            if time.perf_counter() > deadline:
+                break
+        elapsed = time.perf_counter() - start
+        nodes = self.root.visits - reused
+        self.stats = {
+            "nodes": nodes,
+            "depth": self.max_depth,
+            "nodes_per_sec": nodes / elapsed,
+            # Playouts carried over from earlier searches
+            "reused": reused,
+        }
+        return self.best_action()
+
+    def best_action(self):
+        return max(self.root.children, key=lambda child: child.visits).action
+
+    def root_stats(self):
+        '''{action: (visits, total reward)} for each of the root's children.'''
+        return {child.action: (child.visits, child.reward)
+                for child in self.root.children}
+
+    def advance(self, state):
+        '''Move the root down to the node for state, if the tree has one, and
+           otherwise start a new tree.'''
+        node = self.root
+        if node is not None:
+            node = self.find(node, self.root_state.copy(), state)
+        if node is None:
+            node = Node(None)
+        self.root = node
+        self.root_state = state.copy()
+
+    def find(self, node, tree_state, state):
+        '''Follow the moves that lead from tree_state to state, returning the
+           matching node or None.'''
+        for _ in range(tree_state.nplayers * len(tree_state.fish)):
+            if tree_state.current_player == state.current_player \
+                    and tree_state.occupancy == state.occupancy \
+                    and tree_state.fish == state.fish:
+                return node
+
+            player = tree_state.current_player
+            moved = [tile for tile in tree_state.pieces[player]
+                     if tile not in state.pieces[player]]
+            if not moved:
+                if tree_state.can_move(player):
+                    return None
+                action = None
+            elif len(moved) == 1:
+                targ = [tile for tile in state.pieces[player]
+                        if tile not in tree_state.pieces[player]]
+                action = (moved[0], targ[0])
+            else:
+                return None
+
+            for child in node.children:
+                if child.action == action:
+                    break
+            else:
+                return None
+            node = child
+            tree_state.apply(action)
+        return None
+
+    def iterate(self, state):
+        '''One round of selection, expansion, rollout and backpropagation.
+           state is the root state, and is restored before returning.'''
+        node = self.root
+        path = [node]
+        movers = []
+
+        # Selection
+        while node.untried is not None and not node.untried and node.children:
+            log_visits = math.log(node.visits)
+            c = self.exploration
+            best = None
+            best_value = -float("inf")
+            for child in node.children:
+                value = child.reward / child.visits \
+                    + c * math.sqrt(2 * log_visits / child.visits)
+                if value > best_value:
+                    best, best_value = child, value
+            node = best
+            movers.append(state.current_player)
+            state.apply(node.action)
+            path.append(node)
+
+        # Expansion
+        if node.untried is None:
+            node.untried = legal_actions(state)
+            random.shuffle(node.untried)
+        if node.untried:
+            child = Node(node.untried.pop())
+            node.children.append(child)
+            node = child
+            movers.append(state.current_player)
+            state.apply(node.action)
+            path.append(node)
+
+        if len(movers) > self.max_depth:
+            self.max_depth = len(movers)
+
+        # Rollout
+        rewards = self.rollout(state)
+
+        for _ in movers:
+            state.undo()
+
+        # Backpropagation
+        path[0].visits += 1
+        for node, mover in zip(path[1:], movers):
+            node.visits += 1
+            node.reward += rewards[mover]
+
+    def rollout(self, state):
+        '''Play randomly to the end and return each player's reward. If every
+           piece is alone the result is solved exactly instead.'''
+        points = solve_position(state)
+        if points is not None:
+            return [self.reward(points, player) for player in range(state.nplayers)]
+
+        # Random moves don't need islands
+        state = state.copy(islands=False)
+
+        while True:
+            actions = state.getPossibleActions()
+            if actions:
+                state.apply(random.choice(actions))
+            elif state.game_over():
+                break
+            else:
+                state.apply(None)
+        points = state.final_points()
+        return [self.reward(points, player) for player in range(state.nplayers)]
@@ -3,36 +3,53 @@
 from gameboard import GameBoard
 from hex_coords import Hex
 
-import numpy as np
-from math import floor
+import random
+import time
 
 class PengWin:
     '''Wins at being a penguin.'''
-    def __init__(self, pnum, time_lim_ms=5000):
+    def __init__(self, pnum, time_lim_ms=5000, safety_ms=100):
         self.pnum = pnum
         self.time_lim_ms = time_lim_ms
-        calc_time_ms = 0.18
-        self.depths = [1000000, 1000000] \
-                    + [floor(np.log(time_lim_ms/calc_time_ms)/np.log(x)) for x in range(2,100)]
+        # Time left over for the app to copy the board and make the move.
+        self.safety_ms = safety_ms
+        # Zobrist keys don't depend on the turn, so this carries over
+        self.tt = TranspositionTable()
+        # As does the network, brought up to date with the moves since.
+        self.net = None
 
     def get_move(self, initialState):
-        net = Netwerk(initialState)
-        max_num_neighbours = net.max_num_neighbours()
-        depth = self.depths[max_num_neighbours]
-        move,_,_ = next_move(net, depth, self.pnum)
+        deadline = time.perf_counter() + (self.time_lim_ms-self.safety_ms)/1000
+        if self.net is None or not self.net.catch_up(initialState):
+            self.net = Netwerk(initialState)
+        net = self.net
+        self.tt.reset_stats()
+        start = time.perf_counter()
+        search = Search(net, self.pnum, self.tt, deadline)
+        move = search.run()
+        self.stats = {
+            "nodes": search.nodes,
+            "depth": search.depth,
+            "nodes_per_sec": search.nodes / (time.perf_counter() - start),
+            "cache_hit_rate": self.tt.hit_rate(),
+        }
         return (move[0].tile.coords, move[1].tile.coords)
 
 class Node:
     '''A network node representing a tile, 
        with links to every tile which is one move away.'''
-    def __init__(self,hex,tile):
+    def __init__(self,hex,tile,index):
         self.coord = [hex.q, hex.r, hex.s]
         
+        # The tile's index in the board geometry, for hashing.
+        self.index = index
+        
         # The original map tile. N.B. this is not updated as Node is updated.
         self.tile = tile
         
-        # Neighbours with: [[=q&>r, =r&>s, =s&>q], [=q&<r, =r&<s, =s&<q]].
-        self.neighbours = [[[],[],[]],[[],[],[]]]
+        # The tiles in a line in each of the six directions, nearest first,
+        # up to the first that was missing or occupied when the node was made.
+        self.neighbours = []
         
         # Points to the occupant if occupied.
         self.occupant = None
@@ -42,38 +59,13 @@ class Node:
     
     def get_neighbours(self):
         output = []
-        for half in self.neighbours:
-            for line in half:
-                for node in line:
-                    if node.used:
-                        break
-                    output.append(node)
+        for line in self.neighbours:
+            for node in line:
+                if node.used:
+                    break
+                output.append(node)
         return output
     
-    def sort_and_cut(self):
-        '''Sort the inline links, and cut at the first impassable link.'''
-        for i in range(2):
-            for j in range(3):
-                self.neighbours[i][j] = sorted(self.neighbours[i][j],
-                                               key=lambda x:x.coord[j-1],
-                                               reverse=i==1)
-                for k,x in enumerate(self.neighbours[i][j]):
-                    if (x.tile.occupant is not None) or \
-                       (abs(x.coord[j-1]-self.coord[j-1])!=k+1):
-                        self.neighbours[i][j] = self.neighbours[i][j][:k]
-                        break
-    
-def link_if_inline(node1,node2):
-    '''Check if two nodes are inline, and link them if they are.'''
-    for i in range(3):
-        if node2.coord[i]==node1.coord[i]:
-            if node2.coord[i-1]>node1.coord[i-1]:
-                node1.neighbours[0][i].append(node2)
-                node2.neighbours[1][i].append(node1)
-            else:
-                node1.neighbours[1][i].append(node2)
-                node2.neighbours[0][i].append(node1)
-
 class Piece:
     '''Effectively a GamePiece, with reference to a node.'''
     def __init__(self,player_id,node):
@@ -82,23 +74,107 @@ class Piece:
         self.node.occupant = self
         self.node.used = True
 
+class Zobrist:
+    '''Random keys for hashing positions on one board shape.'''
+    def __init__(self, ntiles, nplayers, seed=0):
+        rng = random.Random(seed)
+        key = lambda: rng.getrandbits(64)
+        # A tile that has been removed.
+        self.gone = [key() for _ in range(ntiles)]
+        # A piece of each player on each tile.
+        self.piece = [[key() for _ in range(ntiles)] for _ in range(nplayers)]
+        # The player to move.
+        self.side = [key() for _ in range(nplayers)]
+
+_zobrists = {}
+
+def get_zobrist(ntiles, nplayers):
+    key = (ntiles, nplayers)
+    if key not in _zobrists:
+        _zobrists[key] = Zobrist(ntiles, nplayers)
+    return _zobrists[key]
+
+def position_hash(state):
+    '''The Zobrist hash of a GameBoard, as Netwerk keeps it.'''
+    geometry = state.geometry
+    zobrist = get_zobrist(geometry.ntiles, state.nplayers)
+    hash = zobrist.side[state.current_player]
+    for i, coords in enumerate(geometry.coords):
+        if coords not in state.board:
+            hash ^= zobrist.gone[i]
+    for player_id, player in enumerate(state.players):
+        for piece in player.pieces:
+            hash ^= zobrist.piece[player_id][geometry.index[piece.tile.coords]]
+    return hash
+
 class Netwerk:
     def __init__(self,state):
-        self.nodes = [Node(x,y) for x,y in state.board.items()]
+        geometry = state.geometry
+        index = geometry.index
+        self.nodes = [Node(x,y,index[x]) for x,y in state.board.items()]
+        self.by_index = {node.index: node for node in self.nodes}
         self.pieces = [[] for _ in state.players]
         for node in self.nodes:
             if node.tile.occupant is not None:
                 player_id = state.players.index(node.tile.occupant.owner)
                 self.pieces[player_id].append(Piece(player_id,node))
         
-        for i,node1 in enumerate(self.nodes):
-            for node2 in self.nodes[:i]:
-                link_if_inline(node1,node2)
-        
+        # Follow the board's precomputed rays, which is linear in the number
+        # of tiles rather than comparing every pair.
         for node in self.nodes:
-            node.sort_and_cut()
+            for ray in geometry.rays[node.index]:
+                line = []
+                for i in ray:
+                    other = self.by_index.get(i)
+                    if other is None or other.used:
+                        break
+                    line.append(other)
+                node.neighbours.append(line)
+        
+        # Incremental Zobrist hash of the removed tiles, the pieces and the
+        # player to move.
+        self.zobrist = get_zobrist(geometry.ntiles, len(self.pieces))
+        self.to_move = state.current_player
+        self.hash = position_hash(state)
+    
+    def catch_up(self,state):
+        '''Play the moves (and passes) that lead from this network's position
+           to the board state. Returns False if they can't be worked out, in
+           which case the network should be rebuilt.'''
+        index = state.geometry.index
+        target = position_hash(state)
+        for _ in range(len(self.nodes)*len(self.pieces)+1):
+            if self.hash==target:
+                return True
+            player_id = self.to_move
+            now = set(index[piece.tile.coords]
+                      for piece in state.players[player_id].pieces)
+            moved = [piece for piece in self.pieces[player_id]
+                     if piece.node.index not in now]
+            if not moved:
+                if self.can_move(player_id):
+                    return False
+                self.pass_move()
+                continue
+            if len(moved)!=1:
+                return False
+            was = set(piece.node.index for piece in self.pieces[player_id])
+            destination = [i for i in now if i not in was]
+            node = self.by_index.get(destination[0])
+            if node is None or node.used:
+                return False
+            self.make_move((moved[0].node, node))
+        return False
     
     def make_move(self,move):
+        player_id = move[0].occupant.player_id
+        self.hash ^= self.zobrist.piece[player_id][move[0].index] \
+                   ^ self.zobrist.gone[move[0].index] \
+                   ^ self.zobrist.piece[player_id][move[1].index] \
+                   ^ self.zobrist.side[self.to_move]
+        self.to_move = (self.to_move+1)%len(self.pieces)
+        self.hash ^= self.zobrist.side[self.to_move]
+        
         move[1].occupant = move[0].occupant
         move[0].occupant = None
         move[1].occupant.node = move[1]
@@ -109,6 +185,33 @@ class Netwerk:
         move[1].occupant = None
         move[0].occupant.node = move[0]
         move[1].used = False
+        
+        player_id = move[0].occupant.player_id
+        self.hash ^= self.zobrist.side[self.to_move]
+        self.to_move = (self.to_move-1)%len(self.pieces)
+        self.hash ^= self.zobrist.piece[player_id][move[0].index] \
+                   ^ self.zobrist.gone[move[0].index] \
+                   ^ self.zobrist.piece[player_id][move[1].index] \
+                   ^ self.zobrist.side[self.to_move]
+    
+    def pass_move(self):
+        '''The player to move can't, so skip them.'''
+        self.hash ^= self.zobrist.side[self.to_move]
+        self.to_move = (self.to_move+1)%len(self.pieces)
+        self.hash ^= self.zobrist.side[self.to_move]
+    
+    def unpass_move(self):
+        self.hash ^= self.zobrist.side[self.to_move]
+        self.to_move = (self.to_move-1)%len(self.pieces)
+        self.hash ^= self.zobrist.side[self.to_move]
+    
+    def moves(self,player_id):
+        return [(piece.node, neighbour) for piece in self.pieces[player_id]
+                for neighbour in piece.node.get_neighbours()]
+    
+    def can_move(self,player_id):
+        return any(not line[0].used for piece in self.pieces[player_id]
+                   for line in piece.node.neighbours if line)
     
     def max_num_neighbours(self):
         return max([len(x.get_neighbours()) for x in self.nodes])
@@ -116,30 +219,160 @@ class Netwerk:
 def hex(coord):
     return Hex(coord[0],coord[1],coord[2])
 
-def next_move(net,depth,next_player):
-    best_move = None
-    best_heuristic = None
-    best_score = None
-    for piece in net.pieces[next_player]:
-        for neighbour in piece.node.get_neighbours():
-            move = (piece.node, neighbour)
-            net.make_move(move)
-            heuristic = get_heuristic(net, depth-1, next_player)
-            net.unmake_move(move)
-            heuristic[next_player] += neighbour.tile.value
-            score = get_score(heuristic, next_player)
-            if best_score is None or score>best_score:
-                best_move = move
-                best_heuristic = heuristic
-                best_score = score
-    return best_move, best_heuristic, best_score
+EXACT, LOWER, UPPER = range(3)
 
-def get_heuristic(net,depth,next_player):
-    if depth>0:
-        _, heuristic, _ = next_move(net,depth,(next_player+1)%len(net.pieces))
-        if heuristic is not None:
-            return heuristic
-    return [0 for _ in net.pieces]
+class TranspositionTable:
+    '''A fixed number of slots, indexed by the low bits of the hash.
+       A slot is overwritten by a search at least as deep as the one stored
+       there, or by anything once the stored entry is from an older move.'''
+    def __init__(self, bits=18):
+        self.mask = (1<<bits)-1
+        self.slots = [None]*(1<<bits)
+        self.generation = 0
+        self.reset_stats()
+    
+    def reset_stats(self):
+        '''Start counting hits afresh, and age all stored entries.'''
+        self.generation += 1
+        self.probes = 0
+        self.hits = 0
+    
+    def hit_rate(self):
+        return self.hits/self.probes if self.probes else 0.0
+    
+    def probe(self,hash):
+        '''Returns (depth, value, bound, best move) for the position, or None.'''
+        self.probes += 1
+        entry = self.slots[hash&self.mask]
+        if entry is not None and entry[0]==hash:
+            self.hits += 1
+            return entry[1:5]
+        return None
+    
+    def store(self,hash,depth,value,bound,move):
+        i = hash&self.mask
+        entry = self.slots[i]
+        if entry is None or entry[5]!=self.generation or depth>=entry[1]:
+            self.slots[i] = (hash,depth,value,bound,move,self.generation)
 
-def get_score(heuristic,player):
-    return 2*heuristic[player] - sum(heuristic)
+class SearchTimeout(Exception):
+    pass
+
+class Search:
+    '''Paranoid alpha-beta with iterative deepening: the root player
+       maximises, and everyone else minimises, the fish the root player
+       collects minus the fish everyone else collects.'''
+    def __init__(self, net, root, tt, deadline):
+        self.net = net
+        self.root = root
+        self.tt = tt
+        self.deadline = deadline
+        self.nodes = 0
+        # The deepest completed iteration.
+        self.depth = 0
+    
+    def run(self):
+        moves = self.net.moves(self.root)
+        best = moves[0]
+        # No game lasts more moves than there are free tiles
+        max_depth = sum(not node.used for node in self.net.nodes)
+        depth = 1
+        while depth<=max_depth:
+            self.hit_horizon = False
+            try:
+                value, best = self.search_root(moves, best, depth)
+            except SearchTimeout:
+                break
+            self.depth = depth
+            if not self.hit_horizon:
+                # The whole game tree has been searched
+                break
+            depth += 1
+        return best
+    
+    def search_root(self, moves, pv_move, depth):
+        # Start with the best move from the last iteration
+        moves.sort(key=lambda move: move!=pv_move)
+        alpha = -float("inf")
+        best = None
+        for move in moves:
+            gain = move[1].tile.value
+            self.net.make_move(move)
+            try:
+                value = gain + self.alphabeta(depth-1, alpha-gain, float("inf"))
+            finally:
+                self.net.unmake_move(move)
+            if best is None or value>alpha:
+                alpha = value
+                best = move
+        self.tt.store(self.net.hash, depth, alpha, EXACT,
+                      (best[0].index, best[1].index))
+        return alpha, best
+    
+    def alphabeta(self, depth, alpha, beta):
+        self.nodes += 1
+        if self.nodes&255 == 0 and time.perf_counter()>self.deadline:
+            raise SearchTimeout()
+        if depth==0:
+            self.hit_horizon = True
+            return 0
+        
+        net = self.net
+        hash = net.hash
+        tt_move = None
+        entry = self.tt.probe(hash)
+        if entry is not None:
+            entry_depth, value, bound, tt_move = entry
+            if entry_depth>=depth and (bound==EXACT or
+                    (bound==LOWER and value>=beta) or
+                    (bound==UPPER and value<=alpha)):
+                # The stored search may have been cut short too
+                self.hit_horizon = True
+                return value
+        
+        player = net.to_move
+        moves = net.moves(player)
+        if not moves:
+            if not any(net.can_move(p) for p in range(len(net.pieces))):
+                return 0
+            net.pass_move()
+            try:
+                return self.alphabeta(depth-1, alpha, beta)
+            finally:
+                net.unpass_move()
+        
+        # Try the stored best move first, then the biggest fish
+        moves.sort(key=lambda move: ((move[0].index, move[1].index)!=tt_move,
+                                     -move[1].tile.value))
+        
+        maximising = player==self.root
+        orig_alpha, orig_beta = alpha, beta
+        best_value = -float("inf") if maximising else float("inf")
+        best_move = None
+        for move in moves:
+            gain = move[1].tile.value if maximising else -move[1].tile.value
+            net.make_move(move)
+            try:
+                value = gain + self.alphabeta(depth-1, alpha-gain, beta-gain)
+            finally:
+                net.unmake_move(move)
+            if maximising:
+                if value>best_value:
+                    best_value, best_move = value, move
+                alpha = max(alpha, value)
+            else:
+                if value<best_value:
+                    best_value, best_move = value, move
+                beta = min(beta, value)
+            if alpha>=beta:
+                break
+        
+        if best_value<=orig_alpha:
+            bound = UPPER
+        elif best_value>=orig_beta:
+            bound = LOWER
+        else:
+            bound = EXACT
+        self.tt.store(hash, depth, best_value, bound,
+                      (best_move[0].index, best_move[1].index))
+        return best_value
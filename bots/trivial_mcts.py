@@ -1,12 +1,16 @@
 #!/usr/bin/env python3
 
-from mcts import mcts
+from bots.mcts_engine import MCTS
+from gamestate import GameState
 
 class MctsPlayer:
     def __init__(self, pnum, time_lim_ms=5000):
         self.pnum = pnum
-        self.brain = mcts(timeLimit=time_lim_ms-100)
+        self.time_lim_ms = time_lim_ms - 100
+        self.brain = MCTS()
 
     def get_move(self, initialState):
-        initialState.PROTAGONIST = self.pnum
-        return self.brain.search(initialState=initialState)
\ No newline at end of file
+        state = GameState.from_board(initialState)
+        action = self.brain.search(state, self.time_lim_ms)
+        self.stats = self.brain.stats
+        return state.board_action(action)
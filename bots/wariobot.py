@@ -1,6 +1,9 @@
 from enum import Enum
 import random
 
+from evaluate import evaluate_moves
+from gamestate import GameState
+
 class WarioBot:
     """
         Dumb meme bot that makes moves based on what maximizes potential target value out of the moves that maximize target value
@@ -12,34 +15,24 @@ class WarioBot:
     def get_move(self, currentState):
         currentState.PROTAGONIST = self.pnum
 
-        best_move_score = 0
-        best_actions = set()
+        # Score every move in one go rather than trying each of them out
+        state = GameState.from_board(currentState)
+        actions = state.getPossibleActions()
+        candidates = list(zip(actions, evaluate_moves(state, actions, with_islands=False)))
 
         if random.random() < self.greed:
-            for action in currentState.getPossibleActions():
-                tgt_value = currentState.board[action[1]].value
-
-                if tgt_value > best_move_score:
-                    best_actions = set([action])
-                    best_move_score = tgt_value
-                elif tgt_value == best_move_score:
-                    best_actions.add(action)
-        else:
-            best_actions = set(currentState.getPossibleActions())
-            
+            best_move_score = max(features.target for _, features in candidates)
+            candidates = [(action, features) for action, features in candidates
+                          if features.target == best_move_score]
+
         best_potential_pts = 0
         best_action = None
 
-        for action in best_actions:
-            state = currentState.takeAction(action)
-
-            potential_pts = sum(state.board[a[1]].value for a in \
-                                state.getPossibleActions(objects_to_consider=state.players[self.pnum].pieces))
-
-            if potential_pts > best_potential_pts:
+        for action, features in candidates:
+            if features.potential > best_potential_pts:
                 best_action = action
-                best_potential_pts = potential_pts
+                best_potential_pts = features.potential
 
         if best_action is None:
             return random.choice(currentState.getPossibleActions())
-        return best_action
\ No newline at end of file
+        return state.board_action(best_action)
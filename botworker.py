@@ -0,0 +1,156 @@
+#!/usr/bin/env python3
+
+import atexit
+import copy
+import multiprocessing
+import os
+import signal
+
+
+def serve(conn, player_type, pnum, bot_time_limit_ms, bot_workers,
+          instrumented=False):
+    '''Worker process main loop. Keeps a bot and its own copy of the board
+       alive between moves, so imports and caches stay warm.'''
+    if hasattr(os, "setpgrp"):
+        # Lead a process group of our own, so that anything the bot starts
+        # can be killed along with us
+        os.setpgrp()
+    import instrument
+    from app import make_controller
+    if instrumented:
+        # Before the bot is made, so any processes it starts up front are
+        # counted too
+        instrument.install()
+    controller = make_controller(
+        player_type, pnum, bot_time_limit_ms, bot_workers)
+    board = None
+    # Let the parent know we're warmed up and ready for a move
+    conn.send(None)
+
+    while True:
+        message = conn.recv()
+        if message is None:
+            if hasattr(controller, "close"):
+                controller.close()
+            return
+        seq, full_board, moves, profile_path = message
+
+        if full_board is not None:
+            board = full_board
+        for action in moves:
+            if action is None:
+                board.current_player = (board.current_player + 1) % board.nplayers
+            else:
+                board.apply(action)
+                board.history.clear()
+
+        if instrumented:
+            instrument.reset()
+        with instrument.profiled(profile_path):
+            action = controller.get_move(copy.deepcopy(board))
+        if instrumented:
+            conn.send((seq, action, instrument.bot_stats(controller),
+                       instrument.snapshot()))
+        else:
+            conn.send((seq, action, None, None))
+
+
+class BotWorker:
+    '''Runs a bot in a long-lived process.
+
+       Each turn the process is sent only the moves made since its last
+       turn. If it doesn't answer within the time limit it is killed, so it
+       can't keep thinking on other players' turns, and a fresh one is
+       started straight away to warm up before it is next needed.'''
+    context = multiprocessing.get_context("spawn")
+
+    def __init__(self, player_type, pnum, bot_time_limit_ms=5000, bot_workers=1,
+                 instrumented=False):
+        self.args = (player_type, pnum, bot_time_limit_ms, bot_workers,
+                     instrumented)
+        self.process = None
+        # The bot's stats and hot path counts for its last move, if
+        # instrumented
+        self.stats = None
+        self.counters = None
+        self.start()
+        atexit.register(self.close)
+
+    def start(self):
+        self.conn, child_conn = self.context.Pipe()
+        # Not a daemon, since bots may start processes of their own
+        self.process = self.context.Process(
+            target=serve, args=(child_conn,) + self.args)
+        self.process.start()
+        child_conn.close()
+        # How far through the game's move log the worker's board is, or None
+        # if it hasn't been sent a board yet
+        self.synced = None
+        self.seq = 0
+        self.ready = False
+
+    def wait_ready(self):
+        '''Block until the worker has started up, so that start up time
+           isn't counted against its move.'''
+        if self.ready:
+            return
+        try:
+            self.conn.recv()
+        except EOFError:
+            # It crashed starting up, and will fail the next request_move
+            pass
+        self.ready = True
+
+    def request_move(self, board, move_log, timeout=None, profile_path=None):
+        '''The bot's move, or None if it took longer than timeout seconds.
+           With profile_path, the worker saves a cProfile dump of the move
+           there, unless it is cut off.'''
+        self.wait_ready()
+        self.seq += 1
+        if self.synced is None:
+            message = (self.seq, board, [], profile_path)
+        else:
+            message = (self.seq, None, move_log[self.synced:], profile_path)
+        self.synced = len(move_log)
+
+        try:
+            self.conn.send(message)
+            if self.conn.poll(timeout):
+                seq, action, self.stats, self.counters = self.conn.recv()
+                if seq == self.seq:
+                    return action
+        except (EOFError, BrokenPipeError):
+            # The bot crashed
+            pass
+
+        # Too slow: pre-empt it
+        self.stats = self.counters = None
+        self.kill()
+        self.start()
+        return None
+
+    def kill(self):
+        if self.process is None:
+            return
+        if hasattr(os, "killpg"):
+            # Take any processes the bot started down too. The worker may
+            # have died already and left them behind.
+            try:
+                os.killpg(self.process.pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+        if self.process.is_alive():
+            self.process.terminate()
+        self.process.join()
+        self.process = None
+
+    def close(self):
+        '''Ask the worker to finish, killing it if it won't.'''
+        if self.process is None:
+            return
+        try:
+            self.conn.send(None)
+        except (BrokenPipeError, OSError):
+            pass
+        self.process.join(1)
+        self.kill()
@@ -0,0 +1,277 @@
+#!/usr/bin/env python3
+'''Exact play for pieces that are alone on their islands.
+
+Once nobody else can reach a piece's tiles, the rest of its score is just
+the most fish it can collect along one path of moves, which is small
+enough to search exhaustively on small islands.'''
+
+import collections
+
+from symmetry import canonicalize, original_seat
+
+# Islands bigger than this are left to the normal search.
+MAX_TILES = 24
+
+
+class EndgameSolver:
+    '''Memoises the best haul from (tiles left, piece position) for one
+       board's fish layout, so work carries over between calls and turns.'''
+    def __init__(self, geometry, fish, max_entries=1000000):
+        self.geometry = geometry
+        self.fish = bytearray(fish)
+        self.max_entries = max_entries
+        self.cache = {}
+        # Each player's haul from a whole solved position, or None if it
+        # couldn't be solved, by canonical key (see symmetry.py) and seat
+        self.positions = {}
+
+    def matches(self, fish):
+        '''Whether every tile still on the board has the value we expect.'''
+        mine = self.fish
+        return all(value == 0 or value == mine[i] for i, value in enumerate(fish))
+
+    def best_haul(self, pos, tiles):
+        '''The most fish a lone piece on pos can collect from tiles, counting
+           the tile it is on.'''
+        fish = self.fish
+        mask = 0
+        for tile in tiles:
+            mask |= 1 << tile
+        if len(self.cache) > self.max_entries:
+            self.cache.clear()
+        return fish[pos] + self._best(pos, mask, sum(fish[tile] for tile in tiles))
+
+    def _best(self, pos, mask, total):
+        key = (mask, pos)
+        cache = self.cache
+        if key in cache:
+            return cache[key]
+
+        fish = self.fish
+        best = 0
+        for ray in self.geometry.rays[pos]:
+            for targ in ray:
+                bit = 1 << targ
+                if not mask & bit:
+                    break
+                value = fish[targ] + self._best(targ, mask & ~bit, total - fish[targ])
+                if value > best:
+                    best = value
+            if best == total:
+                # Can't do better than everything
+                break
+
+        cache[key] = best
+        return best
+
+
+# Solvers for the boards seen lately, by (geometry, starting fish), least
+# recently used first. Several games of the same shape at once, as on the
+# server, each keep their own cache.
+_solvers = collections.OrderedDict()
+MAX_SOLVERS = 16
+
+
+def get_solver(state):
+    '''The shared solver for this state's board, starting a new one if none
+       of the recent boards match.'''
+    found = None
+    for key in reversed(_solvers):
+        solver = _solvers[key]
+        if solver.geometry is state.geometry and solver.matches(state.fish):
+            found = key
+            break
+    if found is not None:
+        _solvers.move_to_end(found)
+        return _solvers[found]
+
+    solver = EndgameSolver(state.geometry, state.fish)
+    _solvers[(state.geometry, bytes(state.fish))] = solver
+    while len(_solvers) > MAX_SOLVERS:
+        _solvers.popitem(last=False)
+    return solver
+
+
+def solve_piece(state, player, slot, max_tiles=MAX_TILES):
+    '''The rest of a lone piece's score, counting the tile it is on, or None if
+       it isn't alone, shares its tiles with a team-mate, or has too many
+       tiles to search.'''
+    if state.is_contested(player, slot):
+        return None
+    labels = state.piece_islands(player, slot)
+    for k in range(state.pieces_per_player):
+        if k != slot and state.piece_islands(player, k) & labels:
+            return None
+
+    islands = state.islands()
+    tiles = [tile for island in labels for tile in islands.tiles[island]]
+    if len(tiles) > max_tiles:
+        return None
+    return get_solver(state).best_haul(state.pieces[player][slot], tiles)
+
+
+def solve_position(state, max_tiles=MAX_TILES):
+    '''Final points with perfect play if every piece can be solved on its
+       own, which makes the position a solved leaf for a search. Otherwise
+       None.'''
+    # Most positions fall at this cheap hurdle
+    for player in range(state.nplayers):
+        for slot in range(state.pieces_per_player):
+            if state.is_contested(player, slot):
+                return None
+
+    # Positions that are the same up to the board's symmetries and the
+    # order of the seats have the same hauls
+    solver = get_solver(state)
+    canonical = canonicalize(state)
+    key = (canonical.key, max_tiles)
+    if key not in solver.positions:
+        if len(solver.positions) > solver.max_entries:
+            solver.positions.clear()
+        solver.positions[key] = _hauls(state, canonical, max_tiles)
+    hauls = solver.positions[key]
+    if hauls is None:
+        return None
+
+    final = state.points[:]
+    for seat, haul in enumerate(hauls):
+        final[original_seat(state, canonical, seat)] += haul
+    return final
+
+
+def _hauls(state, canonical, max_tiles):
+    '''Each player's haul in canonical seat order, or None.'''
+    hauls = []
+    for seat in range(state.nplayers):
+        player = original_seat(state, canonical, seat)
+        total = 0
+        for slot in range(state.pieces_per_player):
+            haul = solve_piece(state, player, slot, max_tiles)
+            if haul is None:
+                return None
+            total += haul
+        hauls.append(total)
+    return hauls
+
+
+# Tests
+
+def complain(name):
+    print("FAIL {0}".format(name))
+
+def brute_haul(state, pos, tiles):
+    '''The best haul by trying every path, for checking the solver.'''
+    fish = state.fish
+    rays = state.geometry.rays
+    free = set(tiles)
+
+    def best(pos):
+        result = 0
+        for ray in rays[pos]:
+            for targ in ray:
+                if targ not in free:
+                    break
+                free.remove(targ)
+                result = max(result, fish[targ] + best(targ))
+                free.add(targ)
+        return result
+
+    return fish[pos] + best(pos)
+
+def random_states(count, cols=5, rows=9):
+    import random
+    from gameboard import GameBoard
+    from gamestate import GameState
+    for seed in range(count):
+        rng = random.Random(seed)
+        nplayers = 2 + seed % 3
+        state = GameState.from_board(
+            GameBoard(nplayers, cols=cols, rows=rows, rng=seed))
+        # Late enough for pieces to be cut off
+        for _ in range(rng.randrange(len(state.fish) // 3, len(state.fish))):
+            actions = state.getPossibleActions()
+            if actions:
+                state.apply(rng.choice(actions))
+            elif state.game_over():
+                break
+            else:
+                state.apply(None)
+        yield "seed {}".format(seed), state
+
+def island_state(seed, size):
+    '''A 7x17 state where player 0's first piece is alone on a random island
+       of size tiles, and every other tile left is under a piece.'''
+    import random
+    from gameboard import GameBoard
+    from gamestate import GameState
+    rng = random.Random(seed)
+    state = GameState.from_board(GameBoard(2, rng=seed))
+    geometry = state.geometry
+
+    region = [rng.randrange(geometry.ntiles)]
+    while len(region) < size:
+        n = rng.choice(geometry.neighbours[rng.choice(region)])
+        if n is not None and n not in region:
+            region.append(n)
+    pos = region.pop(rng.randrange(len(region)))
+    away = [i for i in range(geometry.ntiles) if i != pos and all(
+        geometry.grid.distances[i][t] >= 2 for t in region + [pos])]
+    others = rng.sample(away, 2 * state.pieces_per_player - 1)
+
+    state.pieces = [[pos] + others[:state.pieces_per_player - 1],
+                    others[state.pieces_per_player - 1:]]
+    keep = set(region + [pos] + others)
+    for i in range(geometry.ntiles):
+        if i not in keep:
+            state.fish[i] = 0
+        state.occupancy[i] = 0
+    for player, tiles in enumerate(state.pieces):
+        for tile in tiles:
+            state.occupancy[tile] = player + 1
+    state.reach = bytearray(len(state.reach))
+    state.mobility = [0] * state.nplayers
+    for player in range(state.nplayers):
+        for slot in range(state.pieces_per_player):
+            state._scan(player, slot)
+    return state, region
+
+def test_solve_piece():
+    for seed in range(300):
+        size = 1 + seed % 12
+        state, region = island_state(seed, size)
+        haul = solve_piece(state, 0, 0)
+        if haul != brute_haul(state, state.pieces[0][0], region):
+            complain("seed {} island of {} solve_piece".format(seed, size))
+
+    # Positions from real games, solved or not
+    max_tiles = 12
+    for name, state in random_states(300):
+        for player in range(state.nplayers):
+            for slot in range(state.pieces_per_player):
+                haul = solve_piece(state, player, slot, max_tiles)
+                tiles, pieces = state.reachable(player, slot)
+                pos = state.pieces[player][slot]
+                if haul is not None:
+                    if haul != brute_haul(state, pos, tiles):
+                        complain(name + " solve_piece")
+                elif not pieces and len(tiles) <= max_tiles:
+                    # Nobody else anywhere near, so it should have solved it
+                    complain(name + " solve_piece None")
+
+def test_solvers():
+    states = [state for _, state in random_states(3, 7, 17)]
+    solvers = [get_solver(state) for state in states]
+    for state, solver in zip(states, solvers):
+        if get_solver(state) is not solver:
+            complain("get_solver kept")
+    if len(set(map(id, solvers))) != len(solvers):
+        complain("get_solver shared")
+
+
+def test_all():
+    test_solve_piece()
+    test_solvers()
+
+
+if __name__ == "__main__":
+    test_all()
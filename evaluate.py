@@ -0,0 +1,175 @@
+#!/usr/bin/env python3
+'''Score many candidate moves at once without making them.
+
+evaluate_moves works out, for every move, what the position would look
+like for the player making it, from one pass over the current state and
+its islands. No child states are copied or applied.'''
+
+import collections
+
+MoveFeatures = collections.namedtuple("MoveFeatures", [
+    # Fish banked from the tile left behind
+    "gain",
+    # Fish on the tile moved to, banked when it's left in turn
+    "target",
+    # Moves the player will have afterwards
+    "mobility",
+    # Total fish on the tiles those moves go to, counting a tile once per
+    # move onto it
+    "potential",
+    # Fish on the free tiles connected to the moved piece afterwards
+    "island_fish",
+    # Whether anyone else's piece is next to any of those tiles
+    "island_contested",
+])
+# island_fish and island_contested are None unless asked for, since they
+# need the state's islands worked out
+
+
+def evaluate_moves(state, moves=None, with_islands=True):
+    '''MoveFeatures for each of moves (default, all the legal ones) for the
+       player to move in state, in the same order. Without with_islands,
+       island_fish and island_contested are left as None.'''
+    if moves is None:
+        moves = state.getPossibleActions()
+    player = state.current_player
+    geometry = state.geometry
+    rays = geometry.rays
+    lines = geometry.lines
+    neighbours = geometry.neighbours
+    fish = state.fish
+    occupancy = state.occupancy
+    reach = state.reach
+    ppp = state.pieces_per_player
+    pieces = state.pieces[player]
+
+    # The shared scan: for each of the player's pieces, the fish along each
+    # ray up to each reachable distance, so cutting a ray short is a lookup
+    prefix = []
+    for slot, orig in enumerate(pieces):
+        base = 6 * (player * ppp + slot)
+        piece_prefix = []
+        for d in range(6):
+            total = 0
+            sums = [0]
+            for targ in rays[orig][d][:reach[base + d]]:
+                total += fish[targ]
+                sums.append(total)
+            piece_prefix.append(sums)
+        prefix.append(piece_prefix)
+    slot_of = {orig: slot for slot, orig in enumerate(pieces)}
+
+    # How many times opponents' pieces are next to each free tile, and to
+    # each island
+    if with_islands:
+        islands = state.islands()
+        label = islands.label
+        opponents_at = collections.Counter()
+        opponents_on = collections.Counter()
+        for other, tiles in enumerate(state.pieces):
+            if other == player:
+                continue
+            for tile in tiles:
+                for n in neighbours[tile]:
+                    if n is not None and label[n]:
+                        opponents_at[n] += 1
+                        opponents_on[label[n]] += 1
+
+    features = []
+    for orig, targ in moves:
+        moved = slot_of[orig]
+
+        # The other pieces keep their rays, except that targ now blocks any
+        # that ran through it
+        mobility = 0
+        potential = 0
+        for slot, piece in enumerate(pieces):
+            if slot == moved:
+                continue
+            cut = lines[piece].get(targ)
+            for d, sums in enumerate(prefix[slot]):
+                steps = len(sums) - 1
+                if cut is not None and cut[0] == d and cut[1] < steps:
+                    steps = cut[1]
+                mobility += steps
+                potential += sums[steps]
+
+        # The moved piece sees the board from targ. orig is gone, which
+        # blocks it just as the piece standing there does now.
+        for ray in rays[targ]:
+            for tile in ray:
+                if not fish[tile] or occupancy[tile]:
+                    break
+                mobility += 1
+                potential += fish[tile]
+
+        # Taking targ out of its island leaves the rest of it next to targ,
+        # if no longer all in one piece, so that's what the moved piece has
+        if with_islands:
+            island = label[targ]
+            island_fish = islands.fish[island] - fish[targ]
+            contested = opponents_on[island] > opponents_at[targ]
+        else:
+            island_fish = contested = None
+
+        features.append(MoveFeatures(
+            fish[orig], fish[targ], mobility, potential, island_fish,
+            contested))
+    return features
+
+
+# Tests
+
+def complain(name):
+    print("FAIL {0}".format(name))
+
+def check_moves(name, state):
+    '''Compare the features of every move with making it.'''
+    player = state.current_player
+    moves = state.getPossibleActions()
+    quick = evaluate_moves(state, moves, with_islands=False)
+    for move, features, plain in zip(moves, evaluate_moves(state, moves), quick):
+        child = state.copy()
+        child.apply(move)
+        slot = child.pieces[player].index(move[1])
+        actions = child.getPossibleActions(player)
+        tiles, _ = child.reachable(player, slot)
+        expected = MoveFeatures(
+            child.points[player] - state.points[player],
+            state.fish[move[1]],
+            len(actions),
+            sum(child.fish[targ] for _, targ in actions),
+            sum(child.fish[tile] for tile in tiles),
+            child.is_contested(player, slot))
+        for field, value, wanted in zip(MoveFeatures._fields, features, expected):
+            if value != wanted:
+                complain("{} {} {}".format(name, move, field))
+        if plain[:4] != features[:4] or plain[4:] != (None, None):
+            complain("{} {} with_islands=False".format(name, move))
+
+def test_evaluate_moves():
+    import random
+    from gameboard import GameBoard
+    from gamestate import GameState
+    for seed in range(60):
+        rng = random.Random(seed)
+        nplayers = 2 + seed % 3
+        cols, rows = (5, 9) if seed % 2 else (7, 17)
+        state = GameState.from_board(
+            GameBoard(nplayers, cols=cols, rows=rows, rng=seed))
+        name = "seed {}".format(seed)
+        while not state.game_over():
+            actions = state.getPossibleActions()
+            if actions:
+                check_moves(name, state)
+                state.apply(rng.choice(actions))
+            else:
+                state.apply(None)
+
+
+def test_all():
+    test_evaluate_moves()
+
+
+if __name__ == "__main__":
+    test_all()
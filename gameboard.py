@@ -1,93 +1,52 @@
 #!/usr/bin/env python3
 import sys
 import hex_coords
-import pygame
-import random
-from hex_coords import Hex, qoffset_to_cube, OffsetCoord
+from gamestate import get_geometry
+from boardgen import default_pieces, generate
 import copy
 
-piece_palette = [
-    pygame.Color('0x123ABC'),
-    pygame.Color('0xABC123'),
-    pygame.Color('0x1A2B3C'),
-    pygame.Color('0xC3B2A1'),
-]
-
-tile_palette = [
-    pygame.Color('0x2A3026'),
-    pygame.Color('0xA3506E'),
-    pygame.Color('0xBE783C'),
-]
-
 class GameBoard:
-    def __init__(self, nplayers, pieces=None, cols=7, rows=17):
+    def __init__(self, nplayers, pieces=None, cols=7, rows=17, rng=None,
+                 position=None):
+        # rng is a seed or random.Random for the starting position, or None
+        # for the global random state. Or position gives it exactly, as
+        # (fish, pieces, current player) by tile index like boardgen makes.
         self.board = {} # Coords : Tile
         self.offset = hex_coords.ODD
 
         self.cols = cols
         self.rows = rows
+        self.geometry = get_geometry(cols, rows) # Shared between boards of this shape
 
         self.prev_move = None
+        self.history = [] # Undo stack for apply
 
         self.nplayers = nplayers
 
         if pieces is None:
             # Use defaults
-            if self.nplayers == 2:
-                self.pieces_per_player = 4
-            elif self.nplayers == 3:
-                self.pieces_per_player = 3
-            elif self.nplayers == 4:
-                self.pieces_per_player = 2
-            else:
+            self.pieces_per_player = default_pieces(nplayers)
+            if self.pieces_per_player is None:
                 sys.exit("Invalid # of players!")
         else:
             # Relax player constraints
             self.pieces_per_player = pieces
         
         self.players = [Player(i) for i in range(nplayers)]
-        self.current_player = random.randint(0, nplayers-1)
 
         self.PROTAGONIST = None # N.B. this is not used for game simulation, but is used in the reward function
 
-        #fish_bank = [30,20,10]
-        total_fish = ((rows//2) * cols) + ((rows % 2) * (cols//2 + 1))
-
-        fish_bank = [0, total_fish//3, total_fish//6]
-        fish_bank[0] = total_fish - sum(fish_bank)
-
-        print("Setting up game with {} fish distributed as {}".format(total_fish, fish_bank))
-
-        for col in range(cols):
-            for row in range(rows//2):
-                tile_value = random.randint(0,2)
-                while fish_bank[tile_value] == 0:
-                    tile_value = random.randint(0,2)
-                fish_bank[tile_value] -= 1
-                tile_value += 1
+        if position is None:
+            position = generate(cols, rows, nplayers, self.pieces_per_player, rng)
+        fish, placements, self.current_player = position
 
-                coord = qoffset_to_cube(self.offset, OffsetCoord(col, row))
-                self.board[coord] = GameTile(coord, tile_value)
-
-        # Add the end of the board
-        if rows % 2 == 1:
-            for col in range(0,cols,2):
-                tile_value = random.randint(0,2)
-                while fish_bank[tile_value] == 0:
-                    tile_value = random.randint(0,2)
-                fish_bank[tile_value] -= 1
-                tile_value += 1
-                coord = qoffset_to_cube(hex_coords.EVEN, OffsetCoord(col, rows//2))
-                self.board[coord] = GameTile(coord, tile_value)
-
-        assert all(fish_bank[i] == 0 for i in range(len(fish_bank)))
+        for coord, tile_value in zip(self.geometry.coords, fish):
+            self.board[coord] = GameTile(coord, tile_value)
 
         # Player piece placement, for now randomize
-        for player in self.players:
-            for _ in range(self.pieces_per_player):
-                target = random.choice(list(self.board.values()))
-                while target.occupant is not None:
-                    target = random.choice(list(self.board.values()))
+        for player, tiles in zip(self.players, placements):
+            for i in tiles:
+                target = self.board[self.geometry.coords[i]]
                 piece = GamePiece(player, target)
 
                 # N.B. store the same piece in two places, make sure to keep this consistent
@@ -105,7 +64,7 @@ class GameBoard:
             # Default: run over current player's pieces
             coords_to_consider = [p.tile.coords for p in self.players[self.current_player].pieces]
         elif objects_to_consider[0].__str__().startswith("Hex"):
-            pass
+            coords_to_consider = objects_to_consider
         elif isinstance(objects_to_consider[0], GameTile):
             coords_to_consider = [t.coords for t in objects_to_consider]
         elif isinstance(objects_to_consider[0], GamePiece):
@@ -115,38 +74,62 @@ class GameBoard:
 
         actions = []
 
+        coords = self.geometry.coords
+        index = self.geometry.index
         for coord in coords_to_consider:
-            for direction in hex_coords.hex_directions:
-                targ = hex_coords.hex_add(direction, coord) 
-                while targ in self.board and self.board[targ].occupant is None:
-                    actions.append((coord, targ))
-                    targ = hex_coords.hex_add(direction, targ)
-        
+            for ray in self.geometry.rays[index[coord]]:
+                for i in ray:
+                    targ = self.board.get(coords[i])
+                    if targ is None or targ.occupant is not None:
+                        break
+                    actions.append((coord, targ.coords))
+
         return actions
     
     def takeAction(self, action):
         if action in self.getPossibleActions():
             dup = copy.deepcopy(self)
-            orig, targ = action
-
-            dup.players[dup.current_player].points += dup.board[orig].value
-            dup.prev_move = (dup.current_player, (orig, targ))
-            for piece in dup.players[dup.current_player].pieces:
-                if piece.tile.coords == orig:
-                    piece.tile = dup.board[targ]
-                    dup.board[targ].occupant = piece
-                    break
-            else:
-                sys.exit("Can't find current player's moved piece")
-            
-            _ = dup.board.pop(orig)
-            dup.current_player = (dup.current_player + 1) % dup.nplayers
-
+            dup.apply(action)
+            # Don't let undo history pile up along chains of copies
+            dup.history.clear()
             return dup
         else:
             print("Invalid Move!")
             return self
 
+    def apply(self, action):
+        # Make a move in place, without checking that it's legal
+        orig, targ = action
+        tile = self.board[orig]
+        piece = tile.occupant
+        if piece is None or piece.owner is not self.players[self.current_player]:
+            sys.exit("Can't find current player's moved piece")
+
+        self.history.append((tile, self.prev_move, self.current_player))
+
+        piece.owner.points += tile.value
+        self.prev_move = (self.current_player, (orig, targ))
+        piece.tile = self.board[targ]
+        piece.tile.occupant = piece
+        tile.occupant = None
+
+        _ = self.board.pop(orig)
+        self.current_player = (self.current_player + 1) % self.nplayers
+
+    def undo(self):
+        # Take back the last move made with apply
+        tile, prev_move, current_player = self.history.pop()
+        piece = self.board[self.prev_move[1][1]].occupant
+
+        self.board[tile.coords] = tile
+        piece.tile.occupant = None
+        piece.tile = tile
+        tile.occupant = piece
+        piece.owner.points -= tile.value
+
+        self.prev_move = prev_move
+        self.current_player = current_player
+
     def isTerminal(self):
         if len(self.getPossibleActions()) == 0:
             return True
@@ -170,16 +153,18 @@ class GameBoard:
         checked_tiles = set([])
         reached_pieces = set([])
 
+        coords = self.geometry.coords
+        index = self.geometry.index
+        neighbours = self.geometry.neighbours
         while len(tiles_to_check) > 0:
             tile = tiles_to_check.pop()
             checked_tiles.add(tile)
-            for i in range(6):
+            for n in neighbours[index[tile.coords]]:
                 # Loop over neighboring tiles
-                neighboring_coords = hex_coords.hex_neighbor(tile.coords, i)
-                if neighboring_coords not in self.board.keys():
+                if n is None or coords[n] not in self.board:
                     # This coordinate is off the edge of the board
                     continue
-                neighboring_tile = self.board[neighboring_coords]
+                neighboring_tile = self.board[coords[n]]
 
                 if neighboring_tile in checked_tiles or neighboring_tile in tiles_to_check:
                     # Ignore tiles we've reached previously
@@ -198,7 +183,6 @@ class GameBoard:
 class Player:
     def __init__(self, num): # TODO: controller, etc
         self.points = 0
-        self.color = piece_palette[num]
         self.pieces = []
 
 class GamePiece:
@@ -210,12 +194,9 @@ class GameTile:
 
     def __init__(self, coord, value):
         self.value = value
-        self.highlighted = False
         self.coords = coord
         self.occupant = None
 
-        self.color = tile_palette[value-1]
-
 if __name__ == "__main__":
     test_board = GameBoard()
     print(test_board.board)
@@ -0,0 +1,543 @@
+#!/usr/bin/env python3
+import hex_coords
+from hex_coords import qoffset_to_cube, OffsetCoord
+
+
+def board_coords(cols, rows):
+    '''The cube coordinates of every tile on a cols x rows board, in the same
+       order GameBoard lays them out.'''
+    coords = []
+    for col in range(cols):
+        for row in range(rows//2):
+            coords.append(qoffset_to_cube(hex_coords.ODD, OffsetCoord(col, row)))
+
+    # The end of the board
+    if rows % 2 == 1:
+        for col in range(0, cols, 2):
+            coords.append(qoffset_to_cube(hex_coords.EVEN, OffsetCoord(col, rows//2)))
+
+    return coords
+
+
+class BoardGeometry:
+    '''Everything about a board that depends only on its shape.
+       Tiles are referred to by their index into coords.'''
+    def __init__(self, cols, rows):
+        self.cols = cols
+        self.rows = rows
+
+        # Tile indices are the grid's IDs
+        self.grid = hex_coords.HexGrid(board_coords(cols, rows))
+        self.coords = self.grid.hexes
+        self.index = self.grid.index
+        self.ntiles = self.grid.size
+
+        # neighbours[i][d] is the tile one step from i in hex_directions[d],
+        # or None if that's off the board
+        self.neighbours = self.grid.neighbours
+
+        # rays[i][d] lists the tiles in a straight line from i in
+        # hex_directions[d], nearest first, up to the edge of the board
+        self.rays = self.grid.rays
+
+        # lines[i] maps every tile in line with i to (direction, distance - 1),
+        # i.e. where it sits in rays[i]
+        self.lines = [
+            {targ: (d, k) for d in range(6) for k, targ in enumerate(self.rays[i][d])}
+            for i in range(self.ntiles)]
+
+    def __deepcopy__(self, memo):
+        # Immutable and shared, so boards that hold one can still be deepcopied
+        return self
+
+    def __reduce__(self):
+        # Rebuild from the shared cache rather than pickling all the tables
+        return (get_geometry, (self.cols, self.rows))
+
+
+_geometries = {}
+
+
+def get_geometry(cols, rows):
+    '''Geometries are shared between all states of the same shape.'''
+    key = (cols, rows)
+    if key not in _geometries:
+        _geometries[key] = BoardGeometry(cols, rows)
+    return _geometries[key]
+
+
+class Islands:
+    '''The free (present and unoccupied) tiles of a state, split into
+       connected islands.
+
+       label[i] is the island tile i is on, or 0 if it isn't free. For each
+       island label, tiles lists its tiles, fish is their total value, and
+       owners has bit p set if one of player p's pieces is next to it.
+    '''
+    __slots__ = ('label', 'tiles', 'fish', 'owners', 'next_label')
+
+    def __init__(self, state):
+        self.label = [0] * state.geometry.ntiles
+        self.tiles = {}
+        self.fish = {}
+        self.next_label = 1
+        for i in range(state.geometry.ntiles):
+            if state.fish[i] and not state.occupancy[i] and not self.label[i]:
+                self._fill(state, i, 0)
+        self.touch(state)
+
+    def copy(self):
+        dup = Islands.__new__(Islands)
+        dup.label = self.label[:]
+        # The tile lists themselves are replaced, never changed
+        dup.tiles = self.tiles.copy()
+        dup.fish = self.fish.copy()
+        dup.owners = self.owners.copy()
+        dup.next_label = self.next_label
+        return dup
+
+    def _fill(self, state, start, old):
+        '''Give the tiles labelled old that connect to start a new label.'''
+        label = self.label
+        neighbours = state.geometry.neighbours
+        new = self.next_label
+        self.next_label += 1
+
+        label[start] = new
+        tiles = [start]
+        for tile in tiles:
+            for n in neighbours[tile]:
+                if n is not None and label[n] == old and state.fish[n] \
+                        and not state.occupancy[n]:
+                    label[n] = new
+                    tiles.append(n)
+
+        self.tiles[new] = tiles
+        self.fish[new] = sum(state.fish[i] for i in tiles)
+        return new
+
+    def touch(self, state):
+        '''Recalculate which players are next to each island.'''
+        label = self.label
+        neighbours = state.geometry.neighbours
+        owners = dict.fromkeys(self.tiles, 0)
+        for player, tiles in enumerate(state.pieces):
+            for tile in tiles:
+                for n in neighbours[tile]:
+                    if n is not None and label[n]:
+                        owners[label[n]] |= 1 << player
+        self.owners = owners
+
+    def remove(self, state, targ):
+        '''Take tile targ, which has just been occupied, out of its island,
+           re-labelling only that island. Returns a token for restore.'''
+        old = self.label[targ]
+        old_tiles = self.tiles.pop(old)
+        old_fish = self.fish.pop(old)
+        self.label[targ] = 0
+
+        new = []
+        for n in state.geometry.neighbours[targ]:
+            if n is not None and self.label[n] == old:
+                new.append(self._fill(state, n, old))
+
+        self.touch(state)
+        return (old, old_tiles, old_fish, new)
+
+    def restore(self, state, token):
+        '''Undo remove, once state has been restored.'''
+        old, old_tiles, old_fish, new = token
+        for island in new:
+            del self.tiles[island]
+            del self.fish[island]
+        for tile in old_tiles:
+            self.label[tile] = old
+        self.tiles[old] = old_tiles
+        self.fish[old] = old_fish
+        self.touch(state)
+
+
+class GameState:
+    '''A compact stand-in for GameBoard, for search.
+
+       fish[i] is the value of tile i, or 0 if it has been removed.
+       occupancy[i] is 0 for an empty tile, or 1 + the owner of the piece on it.
+       pieces[p] lists the tiles of player p's pieces.
+
+       The legal moves of every piece are kept up to date as moves are made:
+       reach[6*n + d] is how many steps piece n (counting over all players'
+       pieces in turn) can slide along rays[tile][d], and mobility[p] is the
+       number of legal moves player p has.
+
+       Islands of free tiles are only worked out if asked for, but once they
+       have been they are also kept up to date.
+
+       Actions are (origin, destination) tile index pairs. This implements
+       the same getPossibleActions / takeAction / isTerminal / getReward
+       interface as GameBoard, and apply / undo for searching in place.
+    '''
+    __slots__ = ('geometry', 'fish', 'occupancy', 'pieces', 'points',
+                 'nplayers', 'pieces_per_player', 'reach', 'mobility',
+                 'current_player', 'prev_move', 'PROTAGONIST', 'history',
+                 '_islands')
+
+    @classmethod
+    def from_board(cls, board):
+        geometry = get_geometry(board.cols, board.rows)
+        state = cls.__new__(cls)
+        state.geometry = geometry
+        state.fish = bytearray(geometry.ntiles)
+        state.occupancy = bytearray(geometry.ntiles)
+        state.nplayers = board.nplayers
+        state.pieces_per_player = board.pieces_per_player
+        state.pieces = [[geometry.index[piece.tile.coords] for piece in player.pieces]
+                        for player in board.players]
+        state.points = [player.points for player in board.players]
+        state.current_player = board.current_player
+        state.PROTAGONIST = board.PROTAGONIST
+        state.history = []
+        state._islands = None
+
+        for coords, tile in board.board.items():
+            state.fish[geometry.index[coords]] = tile.value
+        for player, tiles in enumerate(state.pieces):
+            for i in tiles:
+                state.occupancy[i] = player + 1
+
+        if board.prev_move is None:
+            state.prev_move = None
+        else:
+            mover, (orig, targ) = board.prev_move
+            state.prev_move = (mover, (geometry.index[orig], geometry.index[targ]))
+
+        state.reach = bytearray(6 * state.nplayers * state.pieces_per_player)
+        state.mobility = [0] * state.nplayers
+        for player, tiles in enumerate(state.pieces):
+            for slot in range(len(tiles)):
+                state._scan(player, slot)
+
+        return state
+
+    def copy(self, islands=True):
+        '''With islands=False the copy doesn't keep islands up to date, which
+           makes its moves cheaper until they are asked for again.'''
+        dup = self.__class__.__new__(self.__class__)
+        dup.geometry = self.geometry
+        dup.fish = self.fish[:]
+        dup.occupancy = self.occupancy[:]
+        dup.pieces = [tiles[:] for tiles in self.pieces]
+        dup.points = self.points[:]
+        dup.nplayers = self.nplayers
+        dup.pieces_per_player = self.pieces_per_player
+        dup.reach = self.reach[:]
+        dup.mobility = self.mobility[:]
+        dup.current_player = self.current_player
+        dup.prev_move = self.prev_move
+        dup.PROTAGONIST = self.PROTAGONIST
+        # N.B. a copy can't undo moves made before it was taken
+        dup.history = []
+        if islands and self._islands is not None:
+            dup._islands = self._islands.copy()
+        else:
+            dup._islands = None
+        return dup
+
+    def board_action(self, action):
+        '''Convert an action on this state to one for GameBoard.'''
+        coords = self.geometry.coords
+        return (coords[action[0]], coords[action[1]])
+
+    def state_action(self, action):
+        '''Convert a GameBoard action to one for this state.'''
+        index = self.geometry.index
+        return (index[action[0]], index[action[1]])
+
+    def _scan(self, player, slot):
+        '''Recalculate one piece's reach from scratch.'''
+        fish = self.fish
+        occupancy = self.occupancy
+        reach = self.reach
+        base = 6 * (player * self.pieces_per_player + slot)
+        total = 0
+        for d, ray in enumerate(self.geometry.rays[self.pieces[player][slot]]):
+            steps = 0
+            for targ in ray:
+                if not fish[targ] or occupancy[targ]:
+                    break
+                steps += 1
+            total += steps - reach[base + d]
+            reach[base + d] = steps
+        self.mobility[player] += total
+
+    def legal_destinations(self, player, slot):
+        '''The tiles piece number slot of player can move to.'''
+        reach = self.reach
+        base = 6 * (player * self.pieces_per_player + slot)
+        rays = self.geometry.rays[self.pieces[player][slot]]
+        return [targ for d in range(6) for targ in rays[d][:reach[base + d]]]
+
+    def can_move(self, player):
+        return self.mobility[player] > 0
+
+    def getPossibleActions(self, player=None):
+        if player is None:
+            player = self.current_player
+        reach = self.reach
+        rays = self.geometry.rays
+
+        actions = []
+        base = 6 * player * self.pieces_per_player
+        for orig in self.pieces[player]:
+            for d in range(6):
+                for targ in rays[orig][d][:reach[base + d]]:
+                    actions.append((orig, targ))
+            base += 6
+
+        return actions
+
+    def takeAction(self, action):
+        '''Returns a new state with the action applied. The action must be legal.'''
+        dup = self.copy()
+        dup.apply(action)
+        return dup
+
+    def apply(self, action):
+        '''Make a move in place. The action must be legal, or None to pass.'''
+        player = self.current_player
+        if action is None:
+            self.history.append((None, player))
+            self.current_player = (player + 1) % self.nplayers
+            return
+
+        orig, targ = action
+        tiles = self.pieces[player]
+        slot = tiles.index(orig)
+        value = self.fish[orig]
+
+        entry = (orig, targ, slot, value, self.prev_move, player,
+                 self.reach[:], self.mobility[:])
+
+        self.points[player] += value
+        self.prev_move = (player, action)
+        tiles[slot] = targ
+        self.occupancy[targ] = player + 1
+        self.occupancy[orig] = 0
+        self.fish[orig] = 0
+        self.current_player = (player + 1) % self.nplayers
+
+        # Nobody could move through the origin, since it was occupied, so the
+        # only rays that change are those now blocked by the destination
+        lines = self.geometry.lines
+        reach = self.reach
+        mobility = self.mobility
+        n = 0
+        for owner, owner_tiles in enumerate(self.pieces):
+            for tile in owner_tiles:
+                line = lines[tile].get(targ)
+                if line is not None:
+                    i = 6 * n + line[0]
+                    if line[1] < reach[i]:
+                        mobility[owner] -= reach[i] - line[1]
+                        reach[i] = line[1]
+                n += 1
+        self._scan(player, slot)
+
+        if self._islands is not None:
+            entry += (self._islands.remove(self, targ),)
+        self.history.append(entry)
+
+    def undo(self):
+        '''Take back the last move made with apply.'''
+        entry = self.history.pop()
+        if entry[0] is None:
+            # A pass
+            self.current_player = entry[1]
+            return
+
+        orig, targ, slot, value, prev_move, player, reach, mobility = entry[:8]
+
+        self.current_player = player
+        self.fish[orig] = value
+        self.occupancy[orig] = player + 1
+        self.occupancy[targ] = 0
+        self.pieces[player][slot] = orig
+        self.prev_move = prev_move
+        self.points[player] -= value
+        self.reach = reach
+        self.mobility = mobility
+
+        if self._islands is not None:
+            if len(entry) > 8:
+                self._islands.restore(self, entry[8])
+            else:
+                # Islands were worked out after this move was made
+                self._islands = None
+
+    def islands(self):
+        if self._islands is None:
+            self._islands = Islands(self)
+        return self._islands
+
+    def piece_islands(self, player, slot):
+        '''The labels of the islands next to a piece.'''
+        label = self.islands().label
+        return set(label[n] for n in self.geometry.neighbours[self.pieces[player][slot]]
+                   if n is not None and label[n])
+
+    def reachable(self, player, slot):
+        '''Like GameBoard.reachable: the free tiles a piece could ever get to,
+           and the (player, slot) of other pieces next to them or to it.'''
+        islands = self.islands()
+        labels = self.piece_islands(player, slot)
+        tiles = [tile for island in labels for tile in islands.tiles[island]]
+        adjacent = self.geometry.neighbours[self.pieces[player][slot]]
+        pieces = [(p, k) for p in range(self.nplayers) for k in range(self.pieces_per_player)
+                  if (p, k) != (player, slot) and (self.piece_islands(p, k) & labels
+                                                   or self.pieces[p][k] in adjacent)]
+        return tiles, pieces
+
+    def is_contested(self, player, slot):
+        '''Whether another player could get to any of this piece's tiles.'''
+        owners = self.islands().owners
+        others = ~(1 << player)
+        return any(owners[island] & others for island in self.piece_islands(player, slot))
+
+    def contested_pieces(self):
+        return [(p, k) for p in range(self.nplayers) for k in range(self.pieces_per_player)
+                if self.is_contested(p, k)]
+
+    def lone_pieces(self):
+        '''Pieces that can still move, but only onto tiles nobody else can
+           get to.'''
+        return [(p, k) for p in range(self.nplayers) for k in range(self.pieces_per_player)
+                if self.piece_islands(p, k) and not self.is_contested(p, k)]
+
+    def game_over(self):
+        '''Unlike isTerminal, this allows for players passing.'''
+        return not any(self.mobility)
+
+    def final_points(self):
+        '''Points once the tiles under each piece are added on at the end.'''
+        return [points + sum(self.fish[i] for i in tiles)
+                for points, tiles in zip(self.points, self.pieces)]
+
+    def isTerminal(self):
+        return self.mobility[self.current_player] == 0
+
+    def getReward(self):
+        if not self.isTerminal():
+            return False
+
+        if all(self.points[self.PROTAGONIST] > self.points[i] for i in range(self.nplayers) if i != self.PROTAGONIST):
+            return 1
+        else:
+            return -1
+
+# Tests
+
+def complain(name):
+    print("FAIL {0}".format(name))
+
+def play_both(seed, check, cols=5, rows=9, nplayers=2):
+    '''Plays a seeded random game on a GameBoard and a GameState side by
+       side, taking moves back now and then and all of them at the end,
+       and calls check(name, board, state) after each step.'''
+    import random
+    from gameboard import GameBoard
+    rng = random.Random(seed)
+    board = GameBoard(nplayers, cols=cols, rows=rows, rng=seed)
+    state = GameState.from_board(board)
+    name = "seed {} {}x{} {}p".format(seed, cols, rows, nplayers)
+    # GameBoard has no passes of its own, so True for a move, False for a pass
+    made = []
+
+    def undo():
+        if made.pop():
+            board.undo()
+        else:
+            board.current_player = (board.current_player - 1) % board.nplayers
+        state.undo()
+        check(name + " undo", board, state)
+
+    check(name, board, state)
+    # Going by the board, so a broken state can't keep the game going
+    while any(board.getPossibleActions(player.pieces) for player in board.players):
+        actions = board.getPossibleActions()
+        if actions:
+            action = rng.choice(actions)
+            board.apply(action)
+            state.apply(state.state_action(action))
+            made.append(True)
+        else:
+            board.current_player = (board.current_player + 1) % board.nplayers
+            state.apply(None)
+            made.append(False)
+        check(name, board, state)
+        if rng.random() < 0.1:
+            for _ in range(rng.randint(1, min(3, len(made)))):
+                undo()
+    while made:
+        undo()
+
+def check_moves(name, board, state):
+    for player in range(board.nplayers):
+        pieces = board.players[player].pieces
+        expected = sorted(state.state_action(action)
+                          for action in board.getPossibleActions(pieces))
+        if sorted(state.getPossibleActions(player)) != expected:
+            complain(name + " getPossibleActions")
+        if state.can_move(player) != bool(expected):
+            complain(name + " can_move")
+        if state.points[player] != board.players[player].points:
+            complain(name + " points")
+    if state.current_player != board.current_player:
+        complain(name + " current_player")
+
+def check_reachable(name, board, state):
+    index = state.geometry.index
+    for player in range(board.nplayers):
+        for slot in range(board.pieces_per_player):
+            tiles, pieces = board.reachable(player, slot)
+            expected_tiles = sorted(index[tile.coords] for tile in tiles)
+            owner = board.players.index
+            expected_pieces = sorted(
+                (owner(piece.owner), piece.owner.pieces.index(piece))
+                for piece in pieces)
+            state_tiles, state_pieces = state.reachable(player, slot)
+            if sorted(state_tiles) != expected_tiles:
+                complain(name + " reachable tiles")
+            if sorted(state_pieces) != expected_pieces:
+                complain(name + " reachable pieces")
+
+def check_islands(name, board, state):
+    # Start keeping islands partway through, so that undoing past that point
+    # is covered too
+    if len(state.history) == 5:
+        state.islands()
+    if state._islands is not None:
+        check_reachable(name, board, state)
+        if island_list(state._islands) != island_list(Islands(state)):
+            complain(name + " islands")
+
+def island_list(islands):
+    return sorted((sorted(tiles), islands.fish[label], islands.owners[label])
+                  for label, tiles in islands.tiles.items())
+
+def test_moves():
+    for seed in range(20):
+        play_both(seed, check_moves)
+        play_both(seed, check_moves, 7, 17, 2 + seed % 3)
+
+def test_reachable():
+    for seed in range(20):
+        play_both(seed, check_islands)
+        play_both(seed, check_islands, 7, 17, 2 + seed % 3)
+
+
+def test_all():
+    test_moves()
+    test_reachable()
+
+
+if __name__ == "__main__":
+    test_all()
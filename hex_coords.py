@@ -7,6 +7,8 @@ import math
 Point = collections.namedtuple("Point", ["x", "y"])
 
 _Hex = collections.namedtuple("Hex", ["q", "r", "s"])
+# Hex below is the checked constructor, so point pickle at the class itself
+_Hex.__qualname__ = "_Hex"
 def Hex(q, r, s):
     assert not (round(q + r + s) != 0), "q + r + s must be 0"
     return _Hex(q, r, s)
@@ -165,6 +167,161 @@ def polygon_corners(layout, h):
         corners.append(Point(center.x + offset.x, center.y + offset.y))
     return corners
 
+# Whole arrays at once. These need NumPy, which is only imported when
+# they're called. Hexes are (n, 3) arrays of q, r, s and points are (n, 2)
+# arrays of x, y, so lists of Hex or Point namedtuples can be passed in as is.
+
+def hex_to_pixel_array(layout, hexes):
+    import numpy as np
+    M = layout.orientation
+    h = np.asarray(hexes, dtype=float).reshape(-1, 3)
+    pixels = np.empty((len(h), 2))
+    pixels[:, 0] = (M.f0 * h[:, 0] + M.f1 * h[:, 1]) * layout.size.x + layout.origin.x
+    pixels[:, 1] = (M.f2 * h[:, 0] + M.f3 * h[:, 1]) * layout.size.y + layout.origin.y
+    return pixels
+
+def pixel_to_hex_array(layout, points):
+    import numpy as np
+    M = layout.orientation
+    p = np.asarray(points, dtype=float).reshape(-1, 2)
+    x = (p[:, 0] - layout.origin.x) / layout.size.x
+    y = (p[:, 1] - layout.origin.y) / layout.size.y
+    hexes = np.empty((len(p), 3))
+    hexes[:, 0] = M.b0 * x + M.b1 * y
+    hexes[:, 1] = M.b2 * x + M.b3 * y
+    hexes[:, 2] = -hexes[:, 0] - hexes[:, 1]
+    return hexes
+
+def hex_round_array(hexes):
+    import numpy as np
+    h = np.asarray(hexes, dtype=float).reshape(-1, 3)
+    # Python's round, like hex_round, rounds halves to even, as does rint
+    rounded = np.rint(h)
+    diff = np.abs(rounded - h)
+    q_worst = (diff[:, 0] > diff[:, 1]) & (diff[:, 0] > diff[:, 2])
+    r_worst = ~q_worst & (diff[:, 1] > diff[:, 2])
+    s_worst = ~q_worst & ~r_worst
+    rounded[q_worst, 0] = -rounded[q_worst, 1] - rounded[q_worst, 2]
+    rounded[r_worst, 1] = -rounded[r_worst, 0] - rounded[r_worst, 2]
+    rounded[s_worst, 2] = -rounded[s_worst, 0] - rounded[s_worst, 1]
+    return rounded.astype(int)
+
+def polygon_corners_array(layout, hexes):
+    import numpy as np
+    offsets = np.array([hex_corner_offset(layout, i) for i in range(0, 6)])
+    return hex_to_pixel_array(layout, hexes)[:, None, :] + offsets[None, :, :]
+
+
+# Integer tile IDs
+
+class HexGrid:
+    '''A fixed set of hexes numbered 0..n-1, with tables indexed by ID so hot
+       loops can work with plain ints and lists instead of Hex tuples.
+       Only the Hex <-> ID conversions should be needed at the UI boundary.'''
+    def __init__(self, hexes):
+        self.hexes = list(hexes)
+        self.size = len(self.hexes)
+        self.index = {h: i for i, h in enumerate(self.hexes)}
+
+        # Dense (q, r) -> ID lookup, -1 where there is no hex
+        self.qmin = min(h.q for h in self.hexes)
+        self.rmin = min(h.r for h in self.hexes)
+        self.height = max(h.r for h in self.hexes) - self.rmin + 1
+        width = max(h.q for h in self.hexes) - self.qmin + 1
+        self.dense = [-1] * (width * self.height)
+        self.width = width
+        for i, h in enumerate(self.hexes):
+            self.dense[(h.q - self.qmin) * self.height + h.r - self.rmin] = i
+
+        # neighbours[i][d] is the ID one step from i in hex_directions[d], or
+        # None if that's not in the grid
+        self.neighbours = []
+        for h in self.hexes:
+            ids = (self.id_at(h.q + d.q, h.r + d.r) for d in hex_directions)
+            self.neighbours.append(tuple(None if n < 0 else n for n in ids))
+
+        # rays[i][d] lists the IDs in a straight line from i in
+        # hex_directions[d], nearest first, up to the edge of the grid
+        self.rays = []
+        for i in range(self.size):
+            rays = []
+            for d in range(6):
+                ray = []
+                n = self.neighbours[i][d]
+                while n is not None:
+                    ray.append(n)
+                    n = self.neighbours[n][d]
+                rays.append(tuple(ray))
+            self.rays.append(tuple(rays))
+
+        # distances[i][j] is the number of steps between i and j
+        self.distances = [
+            [(abs(a.q - b.q) + abs(a.r - b.r) + abs(a.s - b.s)) // 2
+             for b in self.hexes]
+            for a in self.hexes]
+
+        self._centres = {}
+
+    def id_at(self, q, r):
+        '''The ID of the hex at (q, r), or -1.'''
+        q -= self.qmin
+        r -= self.rmin
+        if 0 <= q < self.width and 0 <= r < self.height:
+            return self.dense[q * self.height + r]
+        return -1
+
+    def hex_to_id(self, h):
+        '''The ID of h, or -1 if it isn't in the grid.'''
+        return self.id_at(h.q, h.r)
+
+    def id_to_hex(self, i):
+        return self.hexes[i]
+
+    def pixel_to_id(self, layout, p):
+        '''The ID of the hex under pixel p, or -1. Like
+           hex_round(pixel_to_hex(layout, p)) without building any Hexes.'''
+        M = layout.orientation
+        x = (p[0] - layout.origin.x) / layout.size.x
+        y = (p[1] - layout.origin.y) / layout.size.y
+        q = M.b0 * x + M.b1 * y
+        r = M.b2 * x + M.b3 * y
+        s = -q - r
+        qi = int(round(q))
+        ri = int(round(r))
+        si = int(round(s))
+        q_diff = abs(qi - q)
+        r_diff = abs(ri - r)
+        s_diff = abs(si - s)
+        if q_diff > r_diff and q_diff > s_diff:
+            qi = -ri - si
+        elif r_diff > s_diff:
+            ri = -qi - si
+        return self.id_at(qi, ri)
+
+    def pixels_to_ids(self, layout, points):
+        '''pixel_to_id for an (n, 2) array of points, as an array.'''
+        import numpy as np
+        h = hex_round_array(pixel_to_hex_array(layout, points))
+        q = h[:, 0] - self.qmin
+        r = h[:, 1] - self.rmin
+        inside = (q >= 0) & (q < self.width) & (r >= 0) & (r < self.height)
+        ids = np.full(len(h), -1)
+        ids[inside] = np.asarray(self.dense)[q[inside] * self.height + r[inside]]
+        return ids
+
+    def centres(self, layout):
+        '''Pixel centre of every hex, by ID, for layout.'''
+        if layout not in self._centres:
+            self._centres[layout] = [
+                Point(x, y) for x, y in hex_to_pixel_array(layout, self.hexes).tolist()]
+        return self._centres[layout]
+
+    def corners(self, layout):
+        '''Polygon corners of every hex, by ID, for layout, as lists of
+           (x, y) pairs.'''
+        return [[tuple(p) for p in polygon]
+                for polygon in polygon_corners_array(layout, self.hexes).tolist()]
+
 # Tests
 
 def complain(name):
@@ -269,6 +426,97 @@ def test_doubled_to_cube():
     equal_hex("doubled_to_cube doubled-q", Hex(1, 2, -3), qdoubled_to_cube(DoubledCoord(1, 5)))
     equal_hex("doubled_to_cube doubled-r", Hex(1, 2, -3), rdoubled_to_cube(DoubledCoord(4, 2)))
 
+def make_test_grid():
+    # A lopsided patch of hexes, with a hole in it
+    hexes = [Hex(q, r, -q - r) for q in range(-3, 5) for r in range(-4, 3)
+             if abs(q + r) <= 4 and (q, r) != (1, -1)]
+    return HexGrid(hexes)
+
+def test_points(layout, grid, count=500):
+    # Random points over the grid and a little beyond, and points on the
+    # edges and corners between hexes, where rounding has to break ties
+    import random
+    rng = random.Random(0)
+    centres = [hex_to_pixel(layout, h) for h in grid.hexes]
+    xs = [p.x for p in centres]
+    ys = [p.y for p in centres]
+    points = [Point(rng.uniform(min(xs) - 50, max(xs) + 50),
+                    rng.uniform(min(ys) - 50, max(ys) + 50))
+              for _ in range(count)]
+    for h in grid.hexes:
+        points += polygon_corners(layout, h)
+        for d in range(6):
+            points.append(hex_to_pixel(layout, hex_lerp(h, hex_neighbor(h, d), 0.5)))
+    return points
+
+def test_hex_grid():
+    grid = make_test_grid()
+    for i, h in enumerate(grid.hexes):
+        equal_int("hex_grid hex_to_id", i, grid.hex_to_id(h))
+        equal_int("hex_grid id_at", i, grid.id_at(h.q, h.r))
+        equal_hex("hex_grid id_to_hex", h, grid.id_to_hex(i))
+        for d in range(6):
+            n = hex_neighbor(h, d)
+            expected = grid.index.get(n)
+            if grid.neighbours[i][d] != expected:
+                complain("hex_grid neighbours")
+            ray = []
+            while n in grid.index:
+                ray.append(grid.index[n])
+                n = hex_neighbor(n, d)
+            if list(grid.rays[i][d]) != ray:
+                complain("hex_grid rays")
+        for j, b in enumerate(grid.hexes):
+            equal_int("hex_grid distances", hex_distance(h, b), grid.distances[i][j])
+    equal_int("hex_grid hole", -1, grid.hex_to_id(Hex(1, -1, 0)))
+    equal_int("hex_grid outside", -1, grid.hex_to_id(Hex(10, -5, -5)))
+    equal_int("hex_grid outside", -1, grid.id_at(-4, 0))
+
+def test_hex_grid_pixels():
+    grid = make_test_grid()
+    for layout in [Layout(layout_flat, Point(10.0, 15.0), Point(35.0, 71.0)),
+                   Layout(layout_pointy, Point(7.0, 9.0), Point(-20.0, 3.0))]:
+        for p in test_points(layout, grid):
+            h = hex_round(pixel_to_hex(layout, p))
+            equal_int("hex_grid pixel_to_id", grid.index.get(h, -1),
+                      grid.pixel_to_id(layout, p))
+
+def close_points(name, a, b):
+    equal_int(name, len(a), len(b))
+    for p, q in zip(a, b):
+        if abs(p[0] - q[0]) > 1e-9 or abs(p[1] - q[1]) > 1e-9:
+            complain(name)
+
+def test_arrays():
+    grid = make_test_grid()
+    for layout in [Layout(layout_flat, Point(10.0, 15.0), Point(35.0, 71.0)),
+                   Layout(layout_pointy, Point(7.0, 9.0), Point(-20.0, 3.0))]:
+        close_points("hex_to_pixel_array",
+                     [hex_to_pixel(layout, h) for h in grid.hexes],
+                     hex_to_pixel_array(layout, grid.hexes).tolist())
+        close_points("hex_grid centres",
+                     [hex_to_pixel(layout, h) for h in grid.hexes],
+                     grid.centres(layout))
+        corners = grid.corners(layout)
+        for i, polygon in enumerate(polygon_corners_array(layout, grid.hexes).tolist()):
+            expected = polygon_corners(layout, grid.hexes[i])
+            close_points("polygon_corners_array", expected, polygon)
+            close_points("hex_grid corners", expected, corners[i])
+
+        points = test_points(layout, grid)
+        fractional = pixel_to_hex_array(layout, points).tolist()
+        rounded = hex_round_array(fractional).tolist()
+        ids = grid.pixels_to_ids(layout, points).tolist()
+        for p, f, h, i in zip(points, fractional, rounded, ids):
+            expected = pixel_to_hex(layout, p)
+            if abs(expected.q - f[0]) > 1e-9 or abs(expected.r - f[1]) > 1e-9 \
+                    or abs(expected.s - f[2]) > 1e-9:
+                complain("pixel_to_hex_array")
+            # The same fractional hex either way, so ties break the same way
+            equal_hex("hex_round_array", hex_round(Hex(*f)), Hex(*h))
+            equal_int("hex_grid pixels_to_ids", grid.pixel_to_id(layout, p), i)
+
+
 def test_all():
     test_hex_arithmetic()
     test_hex_direction()
@@ -286,8 +534,15 @@ def test_all():
     test_doubled_roundtrip()
     test_doubled_from_cube()
     test_doubled_to_cube()
+    test_hex_grid()
+    test_hex_grid_pixels()
+    try:
+        import numpy
+    except ImportError:
+        print("SKIP test_arrays, which needs NumPy")
+    else:
+        test_arrays()
 
 
-
-test_all()
-
+if __name__ == "__main__":
+    test_all()
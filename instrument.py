@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+'''Counters and timers around the engine's hot paths, and per-move records.
+
+Nothing is wrapped until install() is called, so when instrumentation is
+off the game runs the plain methods at full speed. Times are inclusive:
+takeAction's time includes the getPossibleActions call it makes.
+
+Bots report on their own search by setting a stats dict after each
+get_move. Use these keys where they make sense, adding any others:
+
+    nodes           positions or playouts searched
+    depth           deepest search depth reached
+    nodes_per_sec
+    cache_hit_rate  transposition or other cache hits, as a fraction
+'''
+
+import collections
+import contextlib
+import cProfile
+import functools
+import importlib
+import json
+import time
+
+# (module, class, method) for everything install() wraps
+HOT_PATHS = [
+    ("gameboard", "GameBoard", "getPossibleActions"),
+    ("gameboard", "GameBoard", "takeAction"),
+    ("gameboard", "GameBoard", "reachable"),
+    ("gamestate", "GameState", "getPossibleActions"),
+    ("gamestate", "GameState", "reachable"),
+]
+
+calls = collections.Counter()
+seconds = collections.Counter()
+
+# (class, method name, original) for each wrapped method
+_installed = []
+
+
+def timed(name, func):
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            calls[name] += 1
+            seconds[name] += time.perf_counter() - start
+    return wrapper
+
+
+def install():
+    '''Start counting calls to the hot paths.'''
+    if _installed:
+        return
+    for module, cls, method in HOT_PATHS:
+        cls = getattr(importlib.import_module(module), cls)
+        original = cls.__dict__[method]
+        setattr(cls, method, timed(cls.__name__ + "." + method, original))
+        _installed.append((cls, method, original))
+
+
+def installed():
+    return bool(_installed)
+
+
+def uninstall():
+    while _installed:
+        cls, method, original = _installed.pop()
+        setattr(cls, method, original)
+
+
+def reset():
+    calls.clear()
+    seconds.clear()
+
+
+def snapshot():
+    '''{name: {"calls": n, "ms": total ms}} for everything called since the
+       last reset.'''
+    return {name: {"calls": calls[name], "ms": 1000 * seconds[name]}
+            for name in calls}
+
+
+def merge(counts):
+    '''Add a snapshot taken in another process, such as one a bot searches
+       in, to the counts here.'''
+    for name, count in counts.items():
+        calls[name] += count["calls"]
+        seconds[name] += count["ms"] / 1000
+
+
+def bot_stats(controller):
+    '''What the bot said about its last move, if anything.'''
+    stats = getattr(controller, "stats", None)
+    return dict(stats) if stats else {}
+
+
+@contextlib.contextmanager
+def profiled(path):
+    '''Profile the block with cProfile and save the stats to path, for
+       pstats or snakeviz. Does nothing if path is None.'''
+    if path is None:
+        yield
+        return
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        profiler.dump_stats(path)
+
+
+class MoveLog:
+    '''Appends one JSON line per move to a file.'''
+    def __init__(self, path):
+        self.file = open(path, "a")
+
+    def record(self, **fields):
+        self.file.write(json.dumps(fields) + "\n")
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
@@ -0,0 +1,453 @@
+#!/usr/bin/env python3
+'''Hosts many games at once over TCP.
+
+Every message is one line of JSON with a "type". Tiles are referred to by
+their index in the board's geometry (see gamestate.BoardGeometry), and a
+move is [origin, target].
+
+Client to server:
+
+    {"type": "create", "seats": ["remote", "mj"], "cols": 7, "rows": 17,
+     "pieces": null, "seed": null, "time_limit_ms": 5000, "join": true}
+        Make a game. Each seat is "remote", for a player who will join over
+        the network, or the name of a bot the server plays. With "join",
+        the creator takes the first remote seat. Everything but seats is
+        optional.
+    {"type": "join", "game": 3}
+        Take the next free remote seat.
+    {"type": "move", "game": 3, "move": [12, 40]}
+
+Server to client:
+
+    {"type": "created", "game": 3}
+    {"type": "joined", "game": 3, "seat": 0}
+    {"type": "setup", "game": 3, "seat": 0, "seats": [...], "cols": 7,
+     "rows": 17, "pieces": 4, "fish": [...], "positions": [[...], ...],
+     "current": 1}
+        Sent to every remote player once all the remote seats are taken.
+        fish[i] is tile i's value and positions[p] lists player p's tiles.
+    {"type": "moved", "game": 3, "player": 1, "move": [5, 9], "next": 0}
+        Every move, to everyone in the game. move is null when the player
+        couldn't move and had to pass.
+    {"type": "game_over", "game": 3, "scores": [...], "abandoned": false}
+    {"type": "error", "message": "..."}
+
+Bots play in a pool of worker processes, so the event loop is never held
+up by a search. A bot that runs over its time limit has a random move made
+for it.
+'''
+
+import argparse
+import asyncio
+import collections
+import functools
+import json
+import os
+import random
+import statistics
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from app import PlayerType, make_controller
+from boardgen import default_pieces
+from gameboard import GameBoard
+from gamestate import GameState
+
+BOTS = [x.name.lower() for x in PlayerType if x != PlayerType.HUMAN]
+
+# Warm bots in this worker process, by (game, seat), oldest first. Moves
+# for one game may land on different workers, in which case the bot just
+# starts from cold.
+_bots = collections.OrderedDict()
+MAX_BOTS = 64
+
+
+def bot_move(key, bot, seat, time_limit_ms, setup, moves):
+    '''Runs in a pool process. Replays the game so far on a GameBoard and
+       asks the bot for its move.'''
+    controller = _bots.pop(key, None)
+    if controller is None:
+        controller = make_controller(PlayerType[bot.upper()], seat, time_limit_ms)
+    _bots[key] = controller
+    while len(_bots) > MAX_BOTS:
+        _bots.popitem(last=False)
+
+    board = board_from_setup(setup)
+    coords = board.geometry.coords
+    for move in moves:
+        if move is None:
+            board.current_player = (board.current_player + 1) % board.nplayers
+        else:
+            board.apply((coords[move[0]], coords[move[1]]))
+    board.history.clear()
+
+    action = controller.get_move(board)
+    index = board.geometry.index
+    return [index[action[0]], index[action[1]]]
+
+
+def board_from_setup(setup):
+    '''A GameBoard for a setup message.'''
+    return GameBoard(
+        len(setup["positions"]), setup["pieces"], setup["cols"], setup["rows"],
+        position=(setup["fish"], setup["positions"], setup["current"]))
+
+
+class Connection:
+    def __init__(self, writer):
+        self.writer = writer
+        # {game id: seat} for every game this connection plays in
+        self.seats = {}
+
+    def send(self, message):
+        line = json.dumps(message, separators=(",", ":")) + "\n"
+        self.writer.write(line.encode())
+
+
+class Game:
+    def __init__(self, gid, seats, cols=7, rows=17, pieces=None, seed=None,
+                 time_limit_ms=5000):
+        self.id = gid
+        self.seats = seats
+        self.time_limit_ms = time_limit_ms
+        board = GameBoard(len(seats), pieces, cols, rows, rng=seed)
+        self.state = GameState.from_board(board)
+        self.setup = {
+            "type": "setup",
+            "game": gid,
+            "seats": seats,
+            "cols": cols,
+            "rows": rows,
+            "pieces": board.pieces_per_player,
+            "fish": list(self.state.fish),
+            "positions": [tiles[:] for tiles in self.state.pieces],
+            "current": self.state.current_player,
+        }
+        # Moves so far, for bots joining in
+        self.moves = []
+        self.clients = [None] * len(seats)
+        # Moves sent by each remote player, or None once someone has left
+        self.inbox = [asyncio.Queue() for _ in seats]
+        self.task = None
+        self.abandoned = False
+
+    def free_seat(self):
+        for seat, kind in enumerate(self.seats):
+            if kind == "remote" and self.clients[seat] is None:
+                return seat
+        return None
+
+    def broadcast(self, message):
+        for client in set(self.clients):
+            if client is not None:
+                client.send(message)
+
+
+class Server:
+    def __init__(self, workers=None):
+        self.games = {}
+        self.next_id = 1
+        self.pool = ProcessPoolExecutor(max_workers=workers)
+        # Bot moves are only handed to the pool when a worker is free, so
+        # their time limit doesn't count time spent queueing
+        self.free_workers = asyncio.Semaphore(workers or os.cpu_count())
+        # Tasks serving each open connection, and their writers
+        self.handlers = set()
+        self.writers = set()
+
+    async def start(self, host="127.0.0.1", port=8765):
+        self.server = await asyncio.start_server(self.handle, host, port)
+        return self.server
+
+    async def close(self):
+        self.server.close()
+        for game in list(self.games.values()):
+            if game.task is not None:
+                game.task.cancel()
+        # Give connections a moment to hang up by themselves
+        if self.handlers:
+            await asyncio.wait(list(self.handlers), timeout=1)
+        for writer in list(self.writers):
+            writer.close()
+        if self.handlers:
+            await asyncio.wait(list(self.handlers), timeout=1)
+        # Drop queued bot moves, then wait for running ones to finish, so the
+        # workers are gone before the interpreter starts shutting down
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(
+            None, functools.partial(self.pool.shutdown, cancel_futures=True))
+
+    async def handle(self, reader, writer):
+        conn = Connection(writer)
+        self.handlers.add(asyncio.current_task())
+        self.writers.add(writer)
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                try:
+                    self.dispatch(conn, json.loads(line))
+                except Exception as e:
+                    # Anything wrong with a message is the client's problem,
+                    # and shouldn't cost it its connection
+                    conn.send({"type": "error", "message": str(e)})
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            for gid in list(conn.seats):
+                self.leave(conn, gid)
+            writer.close()
+            self.handlers.discard(asyncio.current_task())
+            self.writers.discard(writer)
+
+    def dispatch(self, conn, message):
+        kind = message["type"]
+        if kind == "create":
+            seats = [seat.lower() for seat in message["seats"]]
+            for seat in seats:
+                if seat != "remote" and seat not in BOTS:
+                    raise ValueError("Unknown seat {}".format(seat))
+            pieces = message.get("pieces") or default_pieces(len(seats))
+            if pieces is None:
+                raise ValueError("Give pieces per player for {} players".format(
+                    len(seats)))
+            game = Game(self.next_id, seats,
+                        message.get("cols", 7), message.get("rows", 17),
+                        pieces, message.get("seed"),
+                        message.get("time_limit_ms", 5000))
+            self.next_id += 1
+            self.games[game.id] = game
+            conn.send({"type": "created", "game": game.id})
+            if message.get("join"):
+                self.join(conn, game)
+            elif game.free_seat() is None:
+                # Bots only
+                game.task = asyncio.ensure_future(self.run_game(game))
+        elif kind == "join":
+            if message["game"] not in self.games:
+                raise ValueError("No game {}".format(message["game"]))
+            self.join(conn, self.games[message["game"]])
+        elif kind == "move":
+            gid = message["game"]
+            if gid not in conn.seats:
+                raise ValueError("Not playing in game {}".format(gid))
+            game = self.games[gid]
+            seat = conn.seats[gid]
+            if game.task is None or game.state.current_player != seat:
+                raise ValueError("Not your turn in game {}".format(gid))
+            orig, targ = message["move"]
+            game.inbox[seat].put_nowait([int(orig), int(targ)])
+        else:
+            raise ValueError("Unknown message type {}".format(kind))
+
+    def join(self, conn, game):
+        seat = game.free_seat()
+        if seat is None:
+            raise ValueError("Game {} is full".format(game.id))
+        game.clients[seat] = conn
+        conn.seats[game.id] = seat
+        conn.send({"type": "joined", "game": game.id, "seat": seat})
+        if game.free_seat() is None:
+            game.task = asyncio.ensure_future(self.run_game(game))
+
+    def leave(self, conn, gid):
+        game = self.games.get(gid)
+        seat = conn.seats.pop(gid)
+        if game is None:
+            return
+        game.clients[seat] = None
+        if game.task is None:
+            # Hadn't started, so just free the seat up again
+            return
+        game.abandoned = True
+        # Wake the game up if it's waiting on someone
+        for inbox in game.inbox:
+            inbox.put_nowait(None)
+
+    async def run_game(self, game):
+        for seat, client in enumerate(game.clients):
+            if client is not None:
+                client.send(dict(game.setup, seat=seat))
+
+        state = game.state
+        try:
+            while not state.game_over():
+                player = state.current_player
+                if not state.can_move(player):
+                    move = None
+                elif game.seats[player] == "remote":
+                    move = await self.remote_move(game, player)
+                else:
+                    move = await self.bot_move(game, player)
+                if game.abandoned:
+                    break
+                state.apply(move)
+                game.moves.append(move)
+                game.broadcast({"type": "moved", "game": game.id,
+                                "player": player, "move": move,
+                                "next": state.current_player})
+        finally:
+            del self.games[game.id]
+            game.broadcast({"type": "game_over", "game": game.id,
+                            "scores": state.final_points(),
+                            "abandoned": game.abandoned})
+            for client in game.clients:
+                if client is not None:
+                    client.seats.pop(game.id, None)
+
+    async def remote_move(self, game, player):
+        inbox = game.inbox[player]
+        # Drop anything sent before it was this player's turn
+        while not inbox.empty():
+            if inbox.get_nowait() is None:
+                return None
+        while True:
+            move = await inbox.get()
+            if move is None or game.clients[player] is None:
+                # Someone left
+                return None
+            move = tuple(move)
+            if move in game.state.getPossibleActions():
+                return list(move)
+            game.clients[player].send(
+                {"type": "error", "game": game.id,
+                 "message": "Illegal move {}".format(list(move))})
+
+    async def bot_move(self, game, player):
+        loop = asyncio.get_running_loop()
+        await self.free_workers.acquire()
+        try:
+            future = loop.run_in_executor(
+                self.pool, bot_move, (game.id, player), game.seats[player],
+                player, game.time_limit_ms, game.setup, game.moves)
+        except Exception as e:
+            # The pool is broken
+            self.free_workers.release()
+            return self.random_move(game, player, e)
+        # The worker is only free again once the bot has actually finished
+        future.add_done_callback(lambda _: self.free_workers.release())
+        try:
+            # A little grace for getting the work to and from the pool. The
+            # worker can't be stopped, but its answer will be ignored.
+            move = await asyncio.wait_for(
+                asyncio.shield(future), game.time_limit_ms / 1000 + 0.5)
+            if tuple(move) in game.state.getPossibleActions():
+                return move
+            return self.random_move(game, player,
+                                    "illegal move {}".format(move))
+        except asyncio.TimeoutError:
+            return self.random_move(game, player)
+        except Exception as e:
+            # The bot raised, or its worker died
+            return self.random_move(game, player, e)
+
+    def random_move(self, game, player, error=None):
+        if error is not None:
+            print("Bot {} in game {} failed ({})! Taking random action.".format(
+                player, game.id, error))
+        return list(random.choice(game.state.getPossibleActions()))
+
+
+async def read_message(reader):
+    line = await reader.readline()
+    if not line:
+        raise ConnectionError("Server hung up")
+    return json.loads(line)
+
+
+async def play(controller, seats, host="127.0.0.1", port=8765, **options):
+    '''Connect, make a game with seats and play the first remote seat with
+       controller, any bot with get_move. Returns (scores, seconds from
+       sending each move to seeing it played).'''
+    reader, writer = await asyncio.open_connection(host, port)
+    conn = Connection(writer)
+    conn.send(dict(options, type="create", seats=seats, join=True))
+
+    board = None
+    coords = None
+    index = None
+    latencies = []
+    sent = None
+    try:
+        while True:
+            message = await read_message(reader)
+            kind = message["type"]
+            if kind == "error":
+                raise ValueError(message["message"])
+            elif kind == "joined":
+                seat = message["seat"]
+            elif kind == "setup":
+                board = board_from_setup(message)
+                coords = board.geometry.coords
+                index = board.geometry.index
+            elif kind == "moved":
+                move = message["move"]
+                if move is None:
+                    board.current_player = message["next"]
+                else:
+                    board.apply((coords[move[0]], coords[move[1]]))
+                    board.history.clear()
+                if message["player"] == seat and sent is not None:
+                    latencies.append(time.perf_counter() - sent)
+                    sent = None
+            elif kind == "game_over":
+                return message["scores"], latencies
+
+            if kind in ("setup", "moved") and board.current_player == seat \
+                    and board.getPossibleActions():
+                action = controller.get_move(board)
+                sent = time.perf_counter()
+                conn.send({"type": "move", "game": message["game"],
+                           "move": [index[action[0]], index[action[1]]]})
+                await writer.drain()
+    finally:
+        writer.close()
+        await writer.wait_closed()
+
+
+async def demo(games, opponent, workers=None, port=8765, cols=7, rows=17,
+               time_limit_ms=1000):
+    '''Host games of RandomBot against opponent over localhost, all at
+       once, and report throughput and move latency.'''
+    from bots.randombot import RandomBot
+
+    server = Server(workers)
+    await server.start("127.0.0.1", port)
+    start = time.perf_counter()
+    results = await asyncio.gather(*[
+        play(RandomBot(), ["remote", opponent], port=port, cols=cols, rows=rows,
+             seed=game, time_limit_ms=time_limit_ms)
+        for game in range(games)])
+    elapsed = time.perf_counter() - start
+    await server.close()
+
+    latencies = sorted(l for _, game in results for l in game)
+    print("{} games in {:.2f}s, {:.1f} games/s".format(
+        games, elapsed, games / elapsed))
+    print("Move round trip: median {:.2f} ms, 99th percentile {:.2f} ms".format(
+        1000 * statistics.median(latencies),
+        1000 * latencies[int(0.99 * (len(latencies) - 1))]))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Host games over TCP.')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('-w', '--workers', type=int, default=None,
+                        help='Processes for bot moves.')
+    parser.add_argument('--demo', type=int, default=None, metavar='GAMES',
+                        help='Play this many local games against the server '
+                             'at once and report how it went.')
+    parser.add_argument('--opponent', choices=BOTS, default='random',
+                        help='Bot to play in the demo games.')
+    args = parser.parse_args()
+
+    if args.demo is not None:
+        asyncio.run(demo(args.demo, args.opponent, args.workers, args.port))
+    else:
+        async def serve():
+            server = Server(args.workers)
+            await (await server.start(args.host, args.port)).serve_forever()
+        asyncio.run(serve())
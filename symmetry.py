@@ -0,0 +1,277 @@
+#!/usr/bin/env python3
+'''Canonical forms of positions under the board's symmetries.
+
+A board shape can look the same after some reflections or rotations, and
+positions that differ only by one of those, or by which seat is which,
+play out the same way. canonicalize maps all of them to one key, so caches
+keyed on it can share what they learn between them, as endgame.py does for
+solved positions.
+
+Keys describe the rest of the game (fish, pieces and whose turn it is),
+not the points banked so far.'''
+
+import collections
+
+Canonical = collections.namedtuple("Canonical", [
+    # bytes, the same for every equivalent position
+    "key",
+    # Index into the geometry's symmetries of the map from the position to
+    # its canonical form
+    "symmetry",
+    # Seat p in the position is seat (p - seat_shift) % nplayers in the
+    # canonical form, which puts the player to move in seat 0
+    "seat_shift",
+])
+
+
+def _cube_maps():
+    '''The 12 linear maps of cube coordinates that keep the hex grid the
+       same: six rotations, with and without a reflection.'''
+    maps = []
+    for reflect in (False, True):
+        for turns in range(6):
+            def f(q, r, s, reflect=reflect, turns=turns):
+                if reflect:
+                    r, s = s, r
+                for _ in range(turns):
+                    q, r, s = -r, -s, -q
+                return q, r, s
+            maps.append(f)
+    return maps
+
+
+class Symmetries:
+    '''The symmetries of one board shape, as permutations of tile indices.
+       perms[k][i] is where tile i goes under symmetry k, and inverses[k]
+       undoes it. The identity is always symmetry 0.'''
+    def __init__(self, geometry):
+        self.geometry = geometry
+        coords = [(h.q, h.r, h.s) for h in geometry.coords]
+        index = {c: i for i, c in enumerate(coords)}
+        anchor = min(coords)
+
+        self.perms = []
+        for f in _cube_maps():
+            mapped = [f(*c) for c in coords]
+            # The only translation that could line the shapes up
+            low = min(mapped)
+            shift = [a - b for a, b in zip(anchor, low)]
+            perm = []
+            for q, r, s in mapped:
+                i = index.get((q + shift[0], r + shift[1], s + shift[2]))
+                if i is None:
+                    break
+                perm.append(i)
+            else:
+                if tuple(perm) not in self.perms:
+                    self.perms.append(tuple(perm))
+
+        self.inverses = []
+        for perm in self.perms:
+            inverse = [0] * len(perm)
+            for i, j in enumerate(perm):
+                inverse[j] = i
+            self.inverses.append(tuple(inverse))
+
+    def __len__(self):
+        return len(self.perms)
+
+    def move(self, k, move):
+        '''A move in a position, as a move in its image under symmetry k.'''
+        perm = self.perms[k]
+        return (perm[move[0]], perm[move[1]])
+
+    def unmove(self, k, move):
+        '''A move in the image under symmetry k, as a move in the original.'''
+        inverse = self.inverses[k]
+        return (inverse[move[0]], inverse[move[1]])
+
+
+_symmetries = {}
+
+
+def get_symmetries(geometry):
+    if geometry not in _symmetries:
+        _symmetries[geometry] = Symmetries(geometry)
+    return _symmetries[geometry]
+
+
+# Each tile is packed into one byte as fish + 4 * occupancy, where occupancy
+# is the owner's seat + 1, or 0 for nobody. _relabel[nplayers, shift]
+# renumbers the seats in those bytes.
+_relabel = {}
+
+
+def _relabel_table(nplayers, shift):
+    key = (nplayers, shift)
+    if key not in _relabel:
+        table = bytearray(range(256))
+        for seat in range(nplayers):
+            moved = (seat - shift) % nplayers
+            for fish in range(4):
+                table[fish + 4 * (seat + 1)] = fish + 4 * (moved + 1)
+        _relabel[key] = bytes(table)
+    return _relabel[key]
+
+
+def canonicalize(state, rotate_seats=True):
+    '''The Canonical form of a GameState. With rotate_seats, seats are
+       renumbered so the player to move is seat 0, keeping turn order.'''
+    symmetries = get_symmetries(state.geometry)
+    tiles = bytes(f + 4 * o for f, o in zip(state.fish, state.occupancy))
+
+    if rotate_seats:
+        shift = state.current_player
+        tiles = tiles.translate(_relabel_table(state.nplayers, shift))
+        turn = b""
+    else:
+        shift = 0
+        turn = bytes([state.current_player])
+
+    best = None
+    best_k = 0
+    for k, inverse in enumerate(symmetries.inverses):
+        # Tile j of the image is tile inverse[j] of the original
+        image = bytes(map(tiles.__getitem__, inverse))
+        if best is None or image < best:
+            best, best_k = image, k
+    return Canonical(turn + best, best_k, shift)
+
+
+def canonical_move(state, canonical, move):
+    '''A move in state, as the same move in its canonical form.'''
+    return get_symmetries(state.geometry).move(canonical.symmetry, move)
+
+
+def original_move(state, canonical, move):
+    '''A move in the canonical form, such as a cached best move, as a move
+       in state.'''
+    return get_symmetries(state.geometry).unmove(canonical.symmetry, move)
+
+
+def original_seat(state, canonical, seat):
+    '''Seat number in the canonical form, as a seat in state.'''
+    return (seat + canonical.seat_shift) % state.nplayers
+
+
+# Tests
+
+def complain(name):
+    print("FAIL {0}".format(name))
+
+def image(state, k):
+    '''A copy of state moved by symmetry k.'''
+    perm = get_symmetries(state.geometry).perms[k]
+    dup = state.copy(islands=False)
+    for i, j in enumerate(perm):
+        dup.fish[j] = state.fish[i]
+        dup.occupancy[j] = state.occupancy[i]
+    dup.pieces = [[perm[tile] for tile in tiles] for tiles in state.pieces]
+    for player in range(dup.nplayers):
+        for slot in range(dup.pieces_per_player):
+            dup._scan(player, slot)
+    return dup
+
+def rotated(state):
+    '''A copy of state with every seat moved up one.'''
+    n = state.nplayers
+    dup = state.copy(islands=False)
+    for i, owner in enumerate(state.occupancy):
+        if owner:
+            dup.occupancy[i] = owner % n + 1
+    dup.pieces = [state.pieces[(p - 1) % n][:] for p in range(n)]
+    dup.points = [state.points[(p - 1) % n] for p in range(n)]
+    dup.reach = bytearray(len(state.reach))
+    dup.mobility = [0] * n
+    for player in range(n):
+        for slot in range(dup.pieces_per_player):
+            dup._scan(player, slot)
+    dup.current_player = (state.current_player + 1) % n
+    return dup
+
+def test_tables():
+    from gamestate import get_geometry
+    for cols, rows, count in [(7, 17, 4), (5, 9, 4), (7, 16, 2), (6, 8, 2)]:
+        geometry = get_geometry(cols, rows)
+        symmetries = get_symmetries(geometry)
+        name = "symmetries {}x{}".format(cols, rows)
+        if len(symmetries) != count:
+            complain(name + " count")
+        if symmetries.perms[0] != tuple(range(geometry.ntiles)):
+            complain(name + " identity")
+        for perm, inverse in zip(symmetries.perms, symmetries.inverses):
+            if sorted(perm) != list(range(geometry.ntiles)):
+                complain(name + " permutation")
+            if any(inverse[perm[i]] != i for i in range(geometry.ntiles)):
+                complain(name + " inverse")
+            # Neighbours stay neighbours, in the same line
+            for i in range(geometry.ntiles):
+                for ray in geometry.rays[i]:
+                    moved = [perm[tile] for tile in ray]
+                    if moved and tuple(moved) not in geometry.rays[perm[i]]:
+                        complain(name + " rays")
+
+def test_canonical():
+    import random
+    from endgame import solve_position
+    from gameboard import GameBoard
+    from gamestate import GameState
+    for seed in range(30):
+        rng = random.Random(seed)
+        nplayers = 2 + seed % 3
+        board = GameBoard(nplayers, cols=5 + 2 * (seed % 2), rows=9, rng=seed)
+        state = GameState.from_board(board)
+        name = "canonical seed {}".format(seed)
+        for _ in range(rng.randrange(len(state.fish))):
+            actions = state.getPossibleActions()
+            if actions:
+                state.apply(rng.choice(actions))
+            elif state.game_over():
+                break
+            else:
+                state.apply(None)
+
+        canonical = canonicalize(state)
+        symmetries = get_symmetries(state.geometry)
+        solved = solve_position(state)
+        for k in range(len(symmetries)):
+            moved = image(state, k)
+            moved_canonical = canonicalize(moved)
+            if moved_canonical.key != canonical.key:
+                complain(name + " key")
+            legal = set(moved.getPossibleActions())
+            for move in state.getPossibleActions():
+                if symmetries.move(k, move) not in legal:
+                    complain(name + " move")
+                if symmetries.unmove(k, symmetries.move(k, move)) != move:
+                    complain(name + " unmove")
+                if original_move(state, canonical,
+                                 canonical_move(state, canonical, move)) != move:
+                    complain(name + " original_move")
+            # Both positions have the same moves in the canonical form
+            if set(canonical_move(state, canonical, move)
+                   for move in state.getPossibleActions()) \
+                    != set(canonical_move(moved, moved_canonical, move)
+                           for move in legal):
+                complain(name + " canonical_move")
+            if solve_position(moved) != solved:
+                complain(name + " solve_position")
+
+        # Renumbering the seats keeps the key, and solved hauls follow the
+        # players round
+        seats = rotated(state)
+        if canonicalize(seats).key != canonical.key:
+            complain(name + " seats key")
+        if solved is not None:
+            moved_solved = solve_position(seats)
+            if [moved_solved[(p + 1) % nplayers] for p in range(nplayers)] != solved:
+                complain(name + " seats solve_position")
+
+
+def test_all():
+    test_tables()
+    test_canonical()
+
+
+if __name__ == "__main__":
+    test_all()
@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+
+import argparse
+import json
+import os
+import random
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from app import App, PlayerType
+
+
+def play_game(game, players, seed, cols, rows, pieces=None,
+              bot_time_limit_ms=5000, disable_time_limit=False):
+    '''Play one headless game and summarise it.
+       players are listed by seat, so seat i is player i on the board.'''
+    random.seed(seed)
+    app = App(players, display=False, bot_time_limit_ms=bot_time_limit_ms,
+              disable_time_limit=disable_time_limit,
+              pieces=pieces, cols=cols, rows=rows, seed=seed)
+    app.on_execute()
+
+    scores = [player.points for player in app.board.players]
+    best = max(scores)
+    winners = [i for i, score in enumerate(scores) if score == best]
+
+    return {
+        "game": game,
+        "seed": seed,
+        "cols": cols,
+        "rows": rows,
+        "players": [p.name.lower() for p in players],
+        "scores": scores,
+        # Seat of the winner, or None for a draw
+        "winner": winners[0] if len(winners) == 1 else None,
+        "move_times_ms": app.move_times,
+    }
+
+
+def schedule(players, games, seed=0, sizes=((7, 17),)):
+    '''Yields (game, seated players, seed, cols, rows) for each game.
+       Consecutive games replay the same board with the seats rotated, so
+       every entrant gets a turn in every seat.'''
+    n = len(players)
+    for game in range(games):
+        rotation = game % n
+        board = game // n
+        cols, rows = sizes[board % len(sizes)]
+        seated = players[rotation:] + players[:rotation]
+        yield game, seated, seed + board, cols, rows
+
+
+def run_tournament(players, games, results_path, workers=None, seed=0,
+                   sizes=((7, 17),), pieces=None, bot_time_limit_ms=5000,
+                   disable_time_limit=False):
+    '''Play games across a pool of worker processes, appending one JSON line
+       per game to results_path as each one finishes.'''
+    if PlayerType.HUMAN in players:
+        raise ValueError("Tournaments are bots only")
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [
+            pool.submit(play_game, game, seated, game_seed, cols, rows,
+                        pieces, bot_time_limit_ms, disable_time_limit)
+            for game, seated, game_seed, cols, rows
+            in schedule(players, games, seed, sizes)]
+
+        with open(results_path, "a") as results:
+            for future in as_completed(futures):
+                result = future.result()
+                results.write(json.dumps(result) + "\n")
+                results.flush()
+                print("Game {}: {} scored {}".format(
+                    result["game"], result["players"], result["scores"]))
+
+
+def board_size(text):
+    cols, rows = text.lower().split("x")
+    return int(cols), int(rows)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Pit bots against each other.')
+    parser.add_argument('-p',
+                        '--players',
+                        nargs='+',
+                        choices=[x.name.lower() for x in PlayerType
+                                 if x != PlayerType.HUMAN],
+                        required=True,
+                        help='Players, in seat order for the first game.')
+    parser.add_argument('-n', '--games', type=int, default=100,
+                        help='Number of games to play.')
+    parser.add_argument('-w', '--workers', type=int, default=os.cpu_count(),
+                        help='Number of games to play at once.')
+    parser.add_argument('-s', '--seed', type=int, default=0,
+                        help='Seed for the first board.')
+    parser.add_argument('--sizes', nargs='+', type=board_size,
+                        default=[(7, 17)],
+                        help='Board sizes to cycle through, as COLSxROWS.')
+    parser.add_argument('--pieces', type=int, default=None,
+                        help='Pieces per player.')
+    parser.add_argument('-t', '--time-limit', type=int, default=5000,
+                        help='Bot time limit per move in ms.')
+    parser.add_argument('--disable-time-limit', action='store_true',
+                        help="Don't replace slow bots' moves with random ones.")
+    parser.add_argument('-o', '--output', default='results.jsonl',
+                        help='File to append results to.')
+    args = parser.parse_args()
+
+    players = [PlayerType[x.upper()] for x in args.players]
+    run_tournament(players, args.games, args.output, workers=args.workers,
+                   seed=args.seed, sizes=args.sizes, pieces=args.pieces,
+                   bot_time_limit_ms=args.time_limit,
+                   disable_time_limit=args.disable_time_limit)